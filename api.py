@@ -1,58 +1,261 @@
 # api.py
 
-import requests
-from requests.auth import HTTPDigestAuth
+import asyncio
+import json
+import httpx
+import time
+import uuid
 from datetime import datetime, timedelta
+from xml.etree import ElementTree
+from config import DEVICES
+import metrics
 
-DEVICE_IP = "10.10.19.1"
-USER      = "admin"
-PASSWORD  = "qwerty@12"
-
-# Попробуем HTTP на 8000, а при падении — HTTPS на 443
-HTTP_PORT  = 8000
-HTTPS_PORT = 443
-
-# Базовые URL
-BASE_HTTP_URL  = f"http://{DEVICE_IP}:{HTTP_PORT}/ISAPI"
-BASE_HTTPS_URL = f"https://{DEVICE_IP}:{HTTPS_PORT}/ISAPI"
-
-def fetch_access_logs(minutes: int = 5) -> list[dict]:
-    now   = datetime.now()
-    start = now - timedelta(minutes=minutes)
-    ts     = lambda dt: dt.strftime("%Y-%m-%dT%H:%M:%S")
-    url    = (
-        f"/AccessControl/Log?format=json"
-        f"&startTime={ts(start)}"
-        f"&endTime={ts(now)}"
-    )
-    auth = HTTPDigestAuth(USER, PASSWORD)
-
-    # 1) Сначала пробуем HTTP
-    try:
-        resp = requests.get(BASE_HTTP_URL + url, auth=auth, timeout=5)
+TIMEOUT = 5
+STREAM_READ_TIMEOUT = 60  # без данных (и heartbeat) дольше — переподключаемся
+
+PAGE_SIZE = 30   # maxResults одной страницы AcsEvent (лимит прошивки обычно 30)
+MAJOR_EVENT = 5  # major=5 — события контроля доступа
+
+# attendanceStatus (в нижнем регистре) -> направление. Прочие значения
+# ("undefined", пусто) — только если у устройства задан "direction",
+# иначе событие пропускается: угадывать вход/выход нельзя.
+ENTRY_STATUSES = ("checkin", "breakin", "overtimein", "in", "entry")
+EXIT_STATUSES  = ("checkout", "breakout", "overtimeout", "out", "exit")
+
+# (device_id, статус), о которых уже предупредили
+_unknown_seen: set = set()
+
+def ts(dt: datetime) -> str:
+    # Время со смещением передаётся как есть (курсор хранит смещение устройства,
+    # «сейчас» — смещение хоста); без смещения устройство читает его в своём поясе
+    return dt.isoformat(timespec="seconds")
+
+def device_urls(device: dict) -> list[str]:
+    """
+    Базовые URL устройства: основной и, если задан, запасной HTTPS.
+    """
+    urls = [f"{device.get('scheme', 'http')}://{device['host']}:{device['port']}/ISAPI"]
+    if device.get("https_port"):
+        urls.append(f"https://{device['host']}:{device['https_port']}/ISAPI")
+    return urls
+
+def to_event(device: dict, rec: dict) -> dict | None:
+    """
+    Запись AcsEvent -> событие {"student_id","direction","timestamp","device_id","serial_no"}
+    (+ "device_time" — время устройства целиком, со смещением, для курсора;
+    "fetched_at" — когда оно получено с устройства, для трассировки).
+    None — направление не определить (нет "direction" у устройства и статус неизвестен).
+    """
+    direction = device.get("direction")
+    if not direction:
+        status = str(rec.get("attendanceStatus") or "").lower()
+        if status in ENTRY_STATUSES:
+            direction = "Kirdi"
+        elif status in EXIT_STATUSES:
+            direction = "Chiqdi"
+        else:
+            metrics.UNKNOWN_STATUS.inc(1, device["id"])
+            if (device["id"], status) not in _unknown_seen:
+                _unknown_seen.add((device["id"], status))
+                print(f"[{device['id']}] attendanceStatus {status!r} не вход и не выход — "
+                      f"события пропускаются, задайте \"direction\" устройства в config.DEVICES")
+            return None
+    return {
+        "student_id": str(rec["employeeNoString"]),
+        "direction":  direction,
+        "timestamp":  rec["time"][:19],
+        "device_time": rec["time"],
+        "device_id":  device["id"],
+        "serial_no":  rec.get("serialNo"),
+        "fetched_at": time.time(),
+    }
+
+async def iter_access_events(client: httpx.AsyncClient, device: dict,
+                             start: datetime, end: datetime = None,
+                             page_size: int = PAGE_SIZE):
+    """
+    Постраничный поиск AcsEvent (searchID / searchResultPosition / maxResults).
+    Асинхронный генератор: отдаёт страницы событий по мере получения.
+    """
+    end = end or datetime.now().astimezone()
+    auth = httpx.DigestAuth(device["user"], device["password"])
+    search_id = uuid.uuid4().hex
+    position = 0
+    bases = device_urls(device)
+
+    while True:
+        body = {"AcsEventCond": {
+            "searchID":             search_id,
+            "searchResultPosition": position,
+            "maxResults":           page_size,
+            "major":                MAJOR_EVENT,
+            "minor":                0,
+            "startTime":            ts(start),
+            "endTime":              ts(end),
+        }}
+        # Сначала основной адрес, при падении — HTTPS (клиент без проверки сертификата)
+        for base in bases:
+            t0 = time.perf_counter()
+            try:
+                resp = await client.post(base + "/AccessControl/AcsEvent?format=json",
+                                         json=body, auth=auth, timeout=TIMEOUT)
+                resp.raise_for_status()
+                metrics.DEVICE_FETCH.observe(time.perf_counter() - t0, device["id"])
+                break
+            except Exception as e:
+                metrics.DEVICE_ERRORS.inc(1, device["id"])
+                print(f"[{device['id']}] {base} попытка не удалась:", e)
+        else:
+            return
+        # остальные страницы берём с адреса, который ответил
+        bases = [base]
+
+        result = resp.json().get("AcsEvent", {})
+        records = result.get("InfoList", [])
+        page = [ev for rec in records if rec.get("employeeNoString")
+                if (ev := to_event(device, rec))]
+        if page:
+            yield page
+
+        position += result.get("numOfMatches", len(records))
+        if result.get("responseStatusStrg") != "MORE" or not records:
+            return
+
+async def fetch_access_logs(client: httpx.AsyncClient, device: dict,
+                            start: datetime, end: datetime = None) -> list[dict]:
+    """
+    Все события устройства за период (все страницы поиска).
+    """
+    return [ev async for page in iter_access_events(client, device, start, end) for ev in page]
+
+class MultipartParser:
+    """
+    Инкрементальный разбор multipart-потока alertStream.
+    feed() принимает очередной кусок байт и возвращает готовые части:
+    [(headers, body), ...], headers — dict с ключами в нижнем регистре.
+    """
+    def __init__(self, boundary: str):
+        self.delim = b"--" + boundary.encode()
+        self.buf = b""
+
+    def feed(self, data: bytes) -> list[tuple[dict, bytes]]:
+        self.buf += data
+        parts = []
+        while True:
+            start = self.buf.find(self.delim)
+            if start < 0:
+                # хвост может содержать начало разделителя
+                self.buf = self.buf[-len(self.delim):]
+                return parts
+            self.buf = self.buf[start:]
+            hdr_end = self.buf.find(b"\r\n\r\n")
+            if hdr_end < 0:
+                return parts
+            headers = {}
+            for line in self.buf[len(self.delim):hdr_end].split(b"\r\n"):
+                key, sep, value = line.decode("latin-1").partition(":")
+                if sep:
+                    headers[key.strip().lower()] = value.strip()
+            body_start = hdr_end + 4
+            if "content-length" in headers:
+                body_end = body_start + int(headers["content-length"])
+                if len(self.buf) < body_end:
+                    return parts
+            else:
+                body_end = self.buf.find(self.delim, body_start)
+                if body_end < 0:
+                    return parts
+            parts.append((headers, self.buf[body_start:body_end].rstrip(b"\r\n")))
+            self.buf = self.buf[body_end:]
+
+def _local(tag: str) -> str:
+    # {http://www.hikvision.com/ver20/XMLSchema}serialNo -> serialNo
+    return tag.rsplit("}", 1)[-1]
+
+def alert_to_event(device: dict, headers: dict, body: bytes) -> dict | None:
+    """
+    JSON- или XML-часть alertStream -> событие, либо None (heartbeat, прочие события).
+    Битая часть — ValueError / ElementTree.ParseError.
+    """
+    if "json" in headers.get("content-type", ""):
+        data = json.loads(body)
+        ace = data.get("AccessControllerEvent")
+        date_time = data.get("dateTime")
+    else:
+        # EventNotificationAlert: поля AccessControllerEvent на один уровень вложенности
+        root = ElementTree.fromstring(body)
+        ace, date_time = None, None
+        for el in root:
+            if _local(el.tag) == "dateTime":
+                date_time = (el.text or "").strip()
+            elif _local(el.tag) == "AccessControllerEvent":
+                ace = {_local(f.tag): (f.text or "").strip() for f in el}
+    if not ace or not ace.get("employeeNoString"):
+        return None
+    serial = ace.get("serialNo")
+    return to_event(device, {
+        "employeeNoString": ace["employeeNoString"],
+        "time":             date_time or datetime.now().astimezone().isoformat(timespec="seconds"),
+        "serialNo":         int(serial) if serial not in (None, "") else None,
+        "attendanceStatus": ace.get("attendanceStatus"),
+    })
+
+async def iter_alert_stream(client: httpx.AsyncClient, device: dict, on_connect=None):
+    """
+    Держит открытым /ISAPI/Event/notification/alertStream и отдаёт
+    события пачками по мере прихода. Завершается, когда поток закрыт.
+    on_connect — корутина, вызываемая, когда поток уже открыт (догоняющий
+    опрос: события между ним и потоком не теряются, дубликаты отсекаются).
+    Части, которые не удалось разобрать, пропускаются и считаются в метриках.
+    """
+    auth = httpx.DigestAuth(device["user"], device["password"])
+    url = device_urls(device)[0] + "/Event/notification/alertStream"
+    timeout = httpx.Timeout(TIMEOUT, read=STREAM_READ_TIMEOUT)
+    async with client.stream("GET", url, auth=auth, timeout=timeout) as resp:
         resp.raise_for_status()
-    except Exception as e_http:
-        print("HTTP попытка не удалась:", e_http)
-        # 2) Падёт на HTTP — пробуем HTTPS (без проверки сертификата)
-        try:
-            resp = requests.get(
-                BASE_HTTPS_URL + url,
-                auth=auth,
-                timeout=5,
-                verify=False
-            )
-            resp.raise_for_status()
-        except Exception as e_https:
-            print("HTTPS попытка не удалась:", e_https)
-            return []
-
-    data = resp.json().get("data", [])
-    return data
+        if on_connect:
+            await on_connect()
+        _, _, boundary = resp.headers.get("content-type", "").partition("boundary=")
+        parser = MultipartParser(boundary.strip('"') or "MIME_boundary")
+        async for chunk in resp.aiter_bytes():
+            page = []
+            for headers, body in parser.feed(chunk):
+                ctype = headers.get("content-type", "")
+                if "json" not in ctype and "xml" not in ctype:
+                    # картинки и прочие вложения
+                    metrics.STREAM_IGNORED.inc(1, device["id"], "unsupported")
+                    continue
+                try:
+                    ev = alert_to_event(device, headers, body)
+                except (ValueError, ElementTree.ParseError) as e:
+                    metrics.STREAM_IGNORED.inc(1, device["id"], "bad_payload")
+                    print(f"[{device['id']}] alertStream: пропущена битая часть ({ctype}): {e}")
+                    continue
+                if ev:
+                    page.append(ev)
+            if page:
+                yield page
 
-if __name__ == "__main__":
-    logs = fetch_access_logs(10)
+async def fetch_all(client: httpx.AsyncClient, since: dict, minutes: int = 5) -> list[dict]:
+    """
+    Опрашивает все турникеты параллельно и сливает события в один поток.
+    since: { device_id: datetime последнего события }
+    """
+    now = datetime.now().astimezone()
+    results = await asyncio.gather(*(
+        fetch_access_logs(client, d, since.get(d["id"]) or now - timedelta(minutes=minutes), now)
+        for d in DEVICES
+    ))
+    return [ev for evs in results for ev in evs]
+
+async def _main():
+    async with httpx.AsyncClient(verify=False) as client:
+        logs = await fetch_all(client, {}, minutes=10)
     if not logs:
         print("Нет новых записей или не удалось подключиться.")
     else:
         for ev in logs:
-            print(f"{ev['eventTime']} — {ev['personId']} — {ev['entryStatus']}")
+            print(f"{ev['timestamp']} — {ev['device_id']} — {ev['student_id']} — {ev['direction']}")
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -1,50 +1,45 @@
 # api_simulator.py
 
+import asyncio
 import time
 from telegram import Bot
 from config import BOT_TOKEN
-from utils import load_students
 import db
+import dispatcher
+import notifications
+import polling
+import tracing
 
-bot = Bot(token=BOT_TOKEN)
-
-def simulate_student_event(student_id: str, direction: str = "Keldi"):
+def simulate_events(events: list[tuple[str, str]]):
     """
-    direction: "Keldi" или "Chiqdi"
+    events: [(student_id, direction), ...] — сохраняются одной транзакцией
+    и рассылаются всем подписанным родителям, как события турникета
     """
     # текущее время
     ts = time.strftime("%Y-%m-%dT%H:%M:%S")
-    # сохраняем в БД
-    db.add_event(student_id, direction, ts)
-
-    # пробегаемся по списку студентов из JSON
-    students = load_students()
-    for st in students:
-        # ищем тех, чей ID совпал
-        if st["student_id"] != student_id:
-            continue
-        chat_id = st.get("telegram_chat_id")
-        if not chat_id:
-            # если родитель ещё не привязал чат
-            continue
-
-        # подтягиваем настройки уведомлений из БД
-        parent = db.get_parent(chat_id)
-        if not parent:
-            continue
+    polling.handle_events([
+        {"student_id": student_id, "direction": direction, "timestamp": ts}
+        for student_id, direction in events
+    ])
 
-        # фильтры по включённым типам уведомлений
-        if direction == "Keldi" and not parent["entry_on"]:
-            continue
-        if direction == "Chiqdi" and not parent["exit_on"]:
-            continue
-
-        text = f"🎓 {st['name']} ({student_id})\n⏰ {ts}\n➡️ {direction}"
-        bot.send_message(chat_id=chat_id, text=text)
-        print("Sent to", chat_id)
+def simulate_student_event(student_id: str, direction: str = "Keldi"):
+    """
+    direction: "Keldi" или "Chiqdi"
+    """
+    simulate_events([(student_id, direction)])
+
+async def _main():
+    db.init_db()
+    async with Bot(token=BOT_TOKEN) as bot:
+        dispatcher.start(bot)
+        notifications.start()
+        # Примеры вызова
+        simulate_student_event("20201234", "Keldi")
+        await asyncio.sleep(2)
+        simulate_student_event("20201234", "Chiqdi")
+        await notifications.shutdown()
+        await dispatcher.shutdown()
+        await tracing.shutdown()
 
 if __name__ == "__main__":
-    # Примеры вызова
-    simulate_student_event("20201234", "Keldi")
-    time.sleep(2)
-    simulate_student_event("20201234", "Chiqdi")
+    asyncio.run(_main())
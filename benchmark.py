@@ -0,0 +1,242 @@
+# benchmark.py
+# Нагрузочный тест конвейера приёма событий без турникетов и Telegram:
+# генерирует учебный день (студенты, турникеты, утренний пик, дубликаты,
+# события не по порядку), прогоняет его через polling.handle_events ->
+# SQLite -> notifications -> dispatcher с заглушкой Bot и печатает
+# events/s, p50/p99 задержки «приём -> отправка» и размер БД.
+#
+# Запуск: python benchmark.py --students 3000 --gates 8 [--json]
+
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import db
+import dispatcher
+import notifications
+import polling
+import tracing
+
+# Начало приёма каждой пачки: первый rowid пачки и время. Время приёма
+# события ищется по его rowid (он же id трассы, едущий с сообщением).
+_batch_ids: list[int] = []
+_batch_t0: list[float] = []
+
+def ingest_time(event_ids) -> float | None:
+    """Время приёма самого раннего из событий сообщения."""
+    if not event_ids:
+        return None
+    return min(_batch_t0[bisect.bisect_right(_batch_ids, e) - 1] for e in event_ids)
+
+class StubBot:
+    """
+    Заглушка telegram.Bot: записывает задержку и имитирует время ответа API.
+    """
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = 0
+        self.latencies: list[float] = []
+
+    async def send_message(self, chat_id, text, _t0=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+        if _t0 is not None:
+            self.latencies.append(time.perf_counter() - _t0)
+
+class BenchDispatcher(dispatcher.Dispatcher):
+    def enqueue(self, chat_id: int, text: str, trace: tuple = (), **kwargs):
+        # объединённое сообщение меряется от самого раннего события в нём
+        super().enqueue(chat_id, text, trace=trace, _t0=ingest_time(trace), **kwargs)
+
+def seed(students: int, guardians: float):
+    """
+    Список студентов и родителей (часть студентов — с двумя родителями).
+    """
+    ids = [str(20200000 + i) for i in range(students)]
+    with db.transaction() as cur:
+        cur.executemany(
+            "INSERT INTO students(student_id, name, registration_code) VALUES (?, ?, ?)",
+            [(sid, f"Student {sid}", f"C{sid}") for sid in ids]
+        )
+        parents, chat_id = [], 10**9
+        for sid in ids:
+            for _ in range(2 if random.random() < guardians else 1):
+                chat_id += 1
+                parents.append((chat_id, f"Parent {chat_id}", "", sid, "en"))
+        cur.executemany(
+            "INSERT INTO parents(chat_id, name, phone, student_id, language) VALUES (?, ?, ?, ?, ?)",
+            parents
+        )
+    return ids, len(parents)
+
+def generate_day(ids: list[str], serials: list[int], day: datetime, absent: float,
+                 lunch: float, dup_rate: float, jitter: float) -> list[dict]:
+    """
+    События одного дня в порядке доставки.
+    Приход — нормальное распределение вокруг 07:55, уход — вокруг 15:30.
+    serials — последний serialNo каждого турникета, продолжается между днями.
+    Повторные доставки помечены "_dup".
+    """
+    def at(mean_min: float, sd_min: float, lo: int, hi: int) -> datetime:
+        minutes = min(max(random.gauss(mean_min, sd_min), lo), hi)
+        return day + timedelta(minutes=minutes)
+
+    passes = []
+    for sid in ids:
+        if random.random() < absent:
+            continue
+        arrive = at(7 * 60 + 55, 10, 6 * 60 + 30, 10 * 60 + 30)
+        passes.append((arrive, sid, "Kirdi"))
+        if random.random() < lunch:
+            out = at(12 * 60 + 30, 20, 11 * 60 + 30, 14 * 60)
+            passes.append((out, sid, "Chiqdi"))
+            passes.append((out + timedelta(minutes=random.uniform(10, 40)), sid, "Kirdi"))
+        passes.append((at(15 * 60 + 30, 45, 13 * 60, 19 * 60), sid, "Chiqdi"))
+
+    # serialNo растёт на каждом турникете по времени
+    passes.sort()
+    events = []
+    for ts, sid, direction in passes:
+        gate = random.randrange(len(serials))
+        serials[gate] += 1
+        events.append({
+            "student_id": sid,
+            "direction":  direction,
+            "timestamp":  ts.isoformat(timespec="seconds"),
+            "device_id":  f"gate-{gate + 1}",
+            "serial_no":  serials[gate],
+            "_at":        ts.timestamp() + random.uniform(0, jitter),
+        })
+
+    # порядок доставки: задержка сети/страниц перемешивает соседние события
+    events.sort(key=lambda ev: ev["_at"])
+    # повторная доставка (перекрытие окон, повторы запросов)
+    for i in [i for i in range(len(events)) if random.random() < dup_rate]:
+        copy = dict(events[i], _at=events[i]["_at"] + random.uniform(1, 300), _dup=True)
+        events.append(copy)
+    events.sort(key=lambda ev: ev["_at"])
+    return events
+
+def percentile(values: list[float], p: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100)[p - 1]
+
+async def run(args) -> dict:
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="facepass_bench_")
+    db.DB_FILE = os.path.join(workdir, "bench.db")
+    db.STUDENTS_FILE = os.path.join(workdir, "none.json")
+    db.init_db()
+    notifications.COALESCE_WINDOW = args.coalesce
+    # задержка считается по id событий в trace — трассируем каждое
+    tracing.TRACE_EVERY = 1
+    _batch_ids.clear()
+    _batch_t0.clear()
+
+    ids, parents = seed(args.students, args.guardians)
+    day = datetime.combine(datetime.now().date(), datetime.min.time())
+    # дни по порядку, от самого раннего: serialNo турникетов сквозные
+    events, serials = [], [0] * args.gates
+    for d in reversed(range(args.days)):
+        events += generate_day(ids, serials, day - timedelta(days=d), args.absent,
+                               args.lunch, args.dup_rate, args.jitter)
+    injected = sum(1 for ev in events if ev.get("_dup"))
+
+    bot = StubBot(args.send_latency / 1000)
+    if args.telegram_limits:
+        rates = {"global_rate": dispatcher.GLOBAL_RATE, "per_chat_rate": dispatcher.PER_CHAT_RATE}
+    else:
+        rates = {"global_rate": 1e9, "per_chat_rate": 1e9}
+    disp = BenchDispatcher(bot, workers=args.workers, **rates)
+    dispatcher._dispatcher = disp
+    disp.start()
+    notifications.start()
+
+    start = time.perf_counter()
+    ingest = 0.0
+    first_at = events[0]["_at"] if events else 0
+    for i in range(0, len(events), args.batch):
+        batch = [{k: v for k, v in ev.items() if not k.startswith("_")} for ev in events[i:i + args.batch]]
+        if args.speed:
+            # воспроизведение в масштабе времени учебного дня
+            delay = (events[i]["_at"] - first_at) / args.speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        last_id = db.get_conn().execute("SELECT MAX(rowid) FROM events").fetchone()[0] or 0
+        t0 = time.perf_counter()
+        _batch_ids.append(last_id + 1)
+        _batch_t0.append(t0)
+        polling.handle_events(batch)
+        ingest += time.perf_counter() - t0
+        # отдаём управление воркерам диспетчера, как в работающем боте
+        await asyncio.sleep(0)
+
+    await notifications.shutdown()
+    await disp.queue.join()
+    total = time.perf_counter() - start
+    await disp.stop()
+    await tracing.shutdown()
+
+    conn = db.get_conn()
+    stored = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db_size = os.path.getsize(db.DB_FILE)
+    db.close()
+
+    lat = sorted(bot.latencies)
+    return {
+        "students":          args.students,
+        "parents":           parents,
+        "gates":             args.gates,
+        "events_delivered":  len(events),
+        "events_stored":     stored,
+        "duplicates_injected": injected,
+        "duplicates_dropped": len(events) - stored,
+        "ingest_seconds":    round(ingest, 3),
+        "ingest_events_per_s": round(len(events) / ingest, 1) if ingest else None,
+        "total_seconds":     round(total, 3),
+        "messages_sent":     bot.sent,
+        "latency_p50_ms":    round(percentile(lat, 50) * 1000, 2),
+        "latency_p99_ms":    round(percentile(lat, 99) * 1000, 2),
+        "db_size_bytes":     db_size,
+        "db_file":           db.DB_FILE,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Ingestion -> storage -> dispatch benchmark")
+    ap.add_argument("--students", type=int, default=3000)
+    ap.add_argument("--gates", type=int, default=8)
+    ap.add_argument("--days", type=int, default=1, help="сколько учебных дней сгенерировать")
+    ap.add_argument("--guardians", type=float, default=0.2, help="доля студентов с двумя родителями")
+    ap.add_argument("--absent", type=float, default=0.05, help="доля отсутствующих")
+    ap.add_argument("--lunch", type=float, default=0.3, help="доля выходящих на обед")
+    ap.add_argument("--dup-rate", type=float, default=0.05, help="доля повторно доставленных событий")
+    ap.add_argument("--jitter", type=float, default=30, help="разброс доставки, сек (события не по порядку)")
+    ap.add_argument("--batch", type=int, default=30, help="событий в пачке (страница AcsEvent)")
+    ap.add_argument("--speed", type=float, default=0, help="ускорение времени дня; 0 — максимально быстро")
+    ap.add_argument("--workers", type=int, default=dispatcher.WORKERS)
+    ap.add_argument("--send-latency", type=float, default=0, help="задержка ответа заглушки Bot, мс")
+    ap.add_argument("--telegram-limits", action="store_true", help="включить лимиты 30/с и 1/с на чат")
+    ap.add_argument("--coalesce", type=float, default=0, help="окно объединения уведомлений, сек")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    args = ap.parse_args()
+
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in result.items():
+            print(f"{key:22} {value}")
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,98 @@
 # bot.py
 
-import threading
-import time
+import asyncio
 from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, ContextTypes
 import db
-from config import BOT_TOKEN
+from config import BOT_TOKEN, BOT_API_BASE_URL, METRICS_PORT
 from handlers import get_handlers
+import dispatcher
+import metrics
+import notifications
 import polling
+import timing
+import tracing
 
-# Флаг для остановки симуляции (если нужна)
-stop_simulation = threading.Event()
+# Задача симуляции (если нужна)
+sim_task: asyncio.Task | None = None
 
-def start_simulation_loop():
+async def start_simulation_loop():
     from api_simulator import simulate_student_event
 
-    while not stop_simulation.is_set():
-        # Здесь можно подставить любой student_id из students.json
-        simulate_student_event("20201234", direction="Keldi")
-        time.sleep(5)
-
-    print("Simulation loop stopped")
+    try:
+        while True:
+            # Здесь можно подставить любой student_id из students.json
+            try:
+                simulate_student_event("20201234", direction="Keldi")
+            except Exception as e:
+                print(f"Ошибка симуляции: {e}")
+            await asyncio.sleep(5)
+    finally:
+        print("Simulation loop stopped")
 
 async def stop_sim(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    stop_simulation.set()
+    if sim_task:
+        sim_task.cancel()
     await update.message.reply_text("🛑 Simulation stopped")
 
 async def stop_poll(update: Update, context: ContextTypes.DEFAULT_TYPE):
     polling.stop()
     await update.message.reply_text("🛑 Polling stopped")
 
-def main():
-    # 1) Инициализируем базу
-    db.init_db()
-
-    # 2) Запускаем polling в отдельном потоке
-    polling_thread = threading.Thread(target=polling.run_polling, daemon=True)
-    polling_thread.start()
+async def post_init(app: Application):
+    global sim_task
+    if METRICS_PORT:
+        metrics.start(METRICS_PORT)
+    # 2) Запускаем диспетчер уведомлений и polling в общем event loop
+    dispatcher.start(app.bot)
+    notifications.start()
+    tracing.start()
+    polling.start(app)
 
     # 3) Запускаем симуляцию (опционально)
-    sim_thread = threading.Thread(target=start_simulation_loop, daemon=True)
-    sim_thread.start()
+    sim_task = asyncio.create_task(start_simulation_loop())
 
-    # 4) Собираем и запускаем Telegram-бота
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+async def post_stop(app: Application):
+    # Останавливаем фоновые задачи до закрытия Bot
+    if sim_task:
+        sim_task.cancel()
+        await asyncio.gather(sim_task, return_exceptions=True)
+    await polling.shutdown()
+    await notifications.shutdown()
+    await dispatcher.shutdown()
+    await tracing.shutdown()
+    metrics.shutdown()
 
-    # Регистрируем все хэндлеры
-    for handler in get_handlers():
+def build_app(base_url: str = BOT_API_BASE_URL, background: bool = True,
+              concurrent_updates: bool | int = False) -> Application:
+    """
+    Собирает Application со всеми хэндлерами.
+    background=False — без polling турникетов, симуляции и диспетчера (для тестов).
+    """
+    builder = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(concurrent_updates)
+    if base_url:
+        builder = builder.base_url(base_url).base_file_url(base_url.replace("/bot", "/file/bot"))
+    if background:
+        builder = builder.post_init(post_init).post_stop(post_stop)
+    app = builder.build()
+
+    # Регистрируем все хэндлеры (с замером времени, см. /timings)
+    handlers = get_handlers() + [
+        # Команда для остановки симуляции
+        CommandHandler("stop_sim", stop_sim),
+        # Команда для остановки polling
+        CommandHandler("stop_poll", stop_poll),
+    ]
+    for handler in timing.instrument(handlers):
         app.add_handler(handler)
+    return app
+
+def main():
+    # 1) Инициализируем базу
+    db.init_db()
 
-    # Команда для остановки симуляции
-    app.add_handler(CommandHandler("stop_sim", stop_sim))
-    # Команда для остановки polling
-    app.add_handler(CommandHandler("stop_poll", stop_poll))
+    # 4) Собираем и запускаем Telegram-бота
+    app = build_app()
 
     print("Bot started…")
     app.run_polling()
@@ -1,5 +1,31 @@
 # config.py
 BOT_TOKEN = "7722514016:AAGrYL-x80Qmrml8H3S5ZkbZaHg83_yQnbk"
 
+# Адрес Bot API (None — api.telegram.org). Для локального fake_telegram.py:
+# "http://127.0.0.1:8081/bot"
+BOT_API_BASE_URL = None
+
 ADMIN_CODES = {"blyat","SECRET123"}
 
+# Порт /metrics (Prometheus), слушает только 127.0.0.1; None — выключено
+METRICS_PORT = 9108
+
+
+# Турникеты Hikvision (контроллеры доступа).
+# direction — если контроллер стоит только на вход ("Kirdi") или выход ("Chiqdi");
+#   обязателен, если прошивка не отдаёт attendanceStatus вход/выход ("undefined"),
+#   иначе такие события пропускаются;
+# https_port — запасной HTTPS-порт, если основной недоступен;
+# stream — получать события через alertStream (push), polling — как запасной режим.
+DEVICES = [
+    {
+        "id":         "gate-1",
+        "host":       "10.10.19.1",
+        "port":       8000,
+        "scheme":     "http",
+        "https_port": 443,
+        "stream":     True,
+        "user":       "admin",
+        "password":   "qwerty@12",
+    },
+]
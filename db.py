@@ -1,81 +1,643 @@
 # db.py
 
+import json
+import os
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
 
 DB_FILE = "attendance.db"
+# Прежний список студентов — импортируется в таблицу students
+STUDENTS_FILE = "students.json"
+
+# Опоздание: первый вход позже этого времени
+LATE_CUTOFF = "09:30:00"
+
+# Строк за одно чтение курсора при выгрузке
+EXPORT_CHUNK = 1000
+
+# Событий на одной странице истории студента
+HISTORY_PAGE = 20
+
+# Направления, означающие вход ("Keldi" пишет симулятор); всё остальное — выход
+ENTRY_DIRECTIONS = ("Kirdi", "Keldi")
+_ENTRY_SQL = ", ".join(f"'{d}'" for d in ENTRY_DIRECTIONS)
+
+# Режимы сводки для родителя: "" — уведомление на каждое событие
+DIGEST_MODES = ("", "hourly", "daily")
+
+# Настройки соединения: WAL позволяет читать во время записи,
+# synchronous=NORMAL в режиме WAL не делает fsync на каждый commit.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Одно долгоживущее соединение на поток (poller / event loop PTB)
+_local = threading.local()
+
+# Индекс подписчиков: student_id -> { chat_id: настройки уведомлений };
+# строится при первом обращении и обновляется при изменении родителей
+_subscribers: dict | None = None
+_subscriber_of: dict = {}  # chat_id -> student_id
+_subs_lock = threading.Lock()
+
+# LRU-кэш профилей родителей: chat_id -> dict | None (нет такого родителя)
+PARENT_CACHE_SIZE = 4096
+_parent_cache: OrderedDict = OrderedDict()
+_parent_stats = {"hits": 0, "misses": 0}
+_parent_lock = threading.Lock()
+
+# Счётчик SQL-запросов для замеров по хэндлерам; ContextVar переходит
+# и в asyncio.to_thread, поэтому запросы из пула потоков тоже учитываются
+_query_counter: ContextVar = ContextVar("db_query_counter", default=None)
+
+def _count_query(_sql):
+    # счётчик — [n, внешний счётчик]: вложенные блоки считают и во внешние
+    counter = _query_counter.get()
+    while counter is not None:
+        counter[0] += 1
+        counter = counter[1]
+
+@contextmanager
+def count_queries():
+    """
+    Считает SQL-запросы внутри блока: with count_queries() as n: ...; n[0]
+    Блоки можно вкладывать — запрос учитывается в каждом объемлющем.
+    """
+    counter = [0, _query_counter.get()]
+    token = _query_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_counter.reset(token)
+
+def get_conn() -> sqlite3.Connection:
+    """
+    Возвращает соединение текущего потока, открывая его при первом вызове.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_FILE:
+        if conn is not None:
+            conn.close()
+        conn = sqlite3.connect(DB_FILE)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.set_trace_callback(_count_query)
+        _local.conn = conn
+        _local.path = DB_FILE
+    return conn
+
+@contextmanager
+def transaction():
+    """
+    Курсор в транзакции: commit при выходе, rollback при исключении.
+    """
+    conn = get_conn()
+    with conn:
+        yield conn.cursor()
+
+def close():
+    """Закрыть соединение текущего потока."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
 
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    # Таблица событий
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS events (
-        student_id TEXT,
-        direction  TEXT,
-        event_time TEXT
-    )
-    """)
-    # Таблица родителей
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS parents (
-        chat_id    INTEGER PRIMARY KEY,
-        name       TEXT,
-        phone      TEXT,
-        student_id TEXT,
-        language   TEXT,
-        entry_on   INTEGER DEFAULT 1,
-        exit_on    INTEGER DEFAULT 1,
-        late_on    INTEGER DEFAULT 1
-    )
-    """)
-    conn.commit()
-    conn.close()
+    with transaction() as cur:
+        # Таблица событий
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            student_id TEXT,
+            direction  TEXT,
+            event_time TEXT,
+            device_id  TEXT,
+            serial_no  INTEGER
+        )
+        """)
+        # Миграция старой схемы: устройство и serialNo события
+        cols = {r[1] for r in cur.execute("PRAGMA table_info(events)")}
+        if "device_id" not in cols:
+            cur.execute("ALTER TABLE events ADD COLUMN device_id TEXT")
+        if "serial_no" not in cols:
+            cur.execute("ALTER TABLE events ADD COLUMN serial_no INTEGER")
+        # Одно событие устройства хранится один раз (NULL-ы не конфликтуют)
+        cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_events_device_serial
+            ON events(device_id, serial_no)
+        """)
+        # Таблица родителей
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS parents (
+            chat_id    INTEGER PRIMARY KEY,
+            name       TEXT,
+            phone      TEXT,
+            student_id TEXT,
+            language   TEXT,
+            entry_on   INTEGER DEFAULT 1,
+            exit_on    INTEGER DEFAULT 1,
+            late_on    INTEGER DEFAULT 1,
+            digest     TEXT    DEFAULT ''
+        )
+        """)
+        # Миграция: режим сводки вместо уведомлений по каждому событию
+        if "digest" not in {r[1] for r in cur.execute("PRAGMA table_info(parents)")}:
+            cur.execute("ALTER TABLE parents ADD COLUMN digest TEXT DEFAULT ''")
+        # Список студентов (раньше — students.json)
+        has_students = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'students'"
+        ).fetchone()
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS students (
+            student_id        TEXT PRIMARY KEY,
+            name              TEXT,
+            birthdate         TEXT,
+            registration_code TEXT,
+            telegram_chat_id  INTEGER
+        )
+        """)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_students_code
+            ON students(registration_code)
+        """)
+        if not has_students and os.path.exists(STUDENTS_FILE):
+            _import_students(cur, STUDENTS_FILE)
+        # Курсор (watermark) опроса по каждому устройству
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS device_cursor (
+            device_id   TEXT PRIMARY KEY,
+            last_time   TEXT,
+            last_serial INTEGER
+        )
+        """)
+        # Посещаемость по дням, обновляется вместе с событиями
+        has_daily = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_attendance'"
+        ).fetchone()
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS daily_attendance (
+            student_id TEXT,
+            day        TEXT,
+            first_in   TEXT,
+            last_out   TEXT,
+            pass_count INTEGER DEFAULT 0,
+            late       INTEGER DEFAULT 0,
+            PRIMARY KEY (student_id, day)
+        )
+        """)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_daily_day
+            ON daily_attendance(day)
+        """)
+        if not has_daily:
+            _rebuild_daily(cur)
+        # Родители по студенту (индекс подписчиков)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_parents_student
+            ON parents(student_id)
+        """)
+        # Индекс для выборок всех событий за период (выгрузка)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_events_time
+            ON events(event_time)
+        """)
+        # Индекс для выборок по одному студенту за период
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_events_student_time
+            ON events(student_id, event_time)
+        """)
+        # Трассировка событий (см. tracing.py): время в unix-мс;
+        # chat_id = 0 — приём и запись в БД, остальные — доставка в чат
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS event_trace (
+            event_id   INTEGER NOT NULL,
+            chat_id    INTEGER NOT NULL,
+            fetched    INTEGER,
+            committed  INTEGER,
+            enqueued   INTEGER,
+            send_start INTEGER,
+            acked      INTEGER,
+            attempts   INTEGER DEFAULT 0,
+            PRIMARY KEY (event_id, chat_id)
+        ) WITHOUT ROWID
+        """)
 
 def add_event(student_id: str, direction: str, event_time: str):
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
+    with transaction() as cur:
+        cur.execute(
+            "INSERT INTO events(student_id, direction, event_time) VALUES (?, ?, ?)",
+            (student_id, direction, event_time)
+        )
+        _update_daily(cur, [(student_id, direction, event_time)])
+
+def add_events_bulk(events, cursors=()):
+    """
+    Сохраняет пачку событий одной транзакцией, пропуская уже сохранённые
+    (device_id, serial_no). Возвращает реально добавленные события
+    с rowid в конце: [(student_id, direction, event_time, device_id, serial_no, rowid), ...]
+    events:  [(student_id, direction, event_time, device_id, serial_no), ...]
+    cursors: [(device_id, last_time, last_serial), ...] — обновляются
+             в той же транзакции, что и события
+    """
+    added = []
+    with transaction() as cur:
+        for ev in events:
+            cur.execute(
+                "INSERT OR IGNORE INTO events(student_id, direction, event_time, device_id, serial_no) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ev
+            )
+            if cur.rowcount:
+                added.append((*ev, cur.lastrowid))
+        _update_daily(cur, added)
+        cur.executemany(
+            "REPLACE INTO device_cursor(device_id, last_time, last_serial) VALUES (?, ?, ?)",
+            cursors
+        )
+    return added
+
+def _update_daily(cur, events):
+    """
+    Обновляет daily_attendance по новым событиям (внутри транзакции вставки).
+    """
+    cur.executemany(f"""
+        INSERT INTO daily_attendance(student_id, day, first_in, last_out, pass_count)
+        VALUES (?1, substr(?3, 1, 10),
+                CASE WHEN ?2 IN ({_ENTRY_SQL})     THEN ?3 END,
+                CASE WHEN ?2 NOT IN ({_ENTRY_SQL}) THEN ?3 END,
+                1)
+        ON CONFLICT(student_id, day) DO UPDATE SET
+            first_in   = COALESCE(MIN(first_in, excluded.first_in), first_in, excluded.first_in),
+            last_out   = COALESCE(MAX(last_out, excluded.last_out), last_out, excluded.last_out),
+            pass_count = pass_count + 1
+    """, [ev[:3] for ev in events])
+    cur.executemany(
+        "UPDATE daily_attendance SET late = (substr(first_in, 12, 8) > ?) "
+        "WHERE student_id = ? AND day = ? AND first_in IS NOT NULL",
+        {(LATE_CUTOFF, ev[0], ev[2][:10]) for ev in events}
+    )
+
+def _rebuild_daily(cur, since_day=None):
+    where, params = ("WHERE event_time >= ?", (since_day,)) if since_day else ("", ())
+    cur.execute(f"DELETE FROM daily_attendance {'WHERE day >= ?' if since_day else ''}", params)
+    cur.execute(f"""
+        INSERT INTO daily_attendance(student_id, day, first_in, last_out, pass_count)
+        SELECT student_id, substr(event_time, 1, 10),
+               MIN(CASE WHEN direction IN ({_ENTRY_SQL})     THEN event_time END),
+               MAX(CASE WHEN direction NOT IN ({_ENTRY_SQL}) THEN event_time END),
+               COUNT(*)
+        FROM events {where}
+        GROUP BY student_id, substr(event_time, 1, 10)
+    """, params)
     cur.execute(
-        "INSERT INTO events(student_id, direction, event_time) VALUES (?, ?, ?)",
-        (student_id, direction, event_time)
+        f"UPDATE daily_attendance SET late = (substr(first_in, 12, 8) > ?) "
+        f"WHERE first_in IS NOT NULL {'AND day >= ?' if since_day else ''}",
+        (LATE_CUTOFF,) + params
     )
-    conn.commit()
-    conn.close()
+
+def rebuild_daily_attendance(since_day: str = None):
+    """
+    Пересчитать daily_attendance из events (целиком или начиная с дня YYYY-MM-DD).
+    """
+    with transaction() as cur:
+        _rebuild_daily(cur, since_day)
+
+def get_cursor(device_id):
+    """
+    Последнее сохранённое событие устройства: (last_time, last_serial) или None.
+    """
+    return get_conn().execute(
+        "SELECT last_time, last_serial FROM device_cursor WHERE device_id = ?",
+        (device_id,)
+    ).fetchone()
+
+def get_event(rowid):
+    """
+    (student_id, event_time) события по rowid или None.
+    """
+    return get_conn().execute(
+        "SELECT student_id, event_time FROM events WHERE rowid = ?", (rowid,)
+    ).fetchone()
 
 def query_events_between(start, end):
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute(
+    cur = get_conn().execute(
         "SELECT student_id, direction, event_time FROM events "
         "WHERE event_time BETWEEN ? AND ?",
         (start.isoformat(), end.isoformat())
     )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    return cur.fetchall()
+
+def iter_events(start, end, student_id=None, chunk=EXPORT_CHUNK):
+    """
+    События за период порциями по chunk строк, по возрастанию времени:
+    не держит в памяти всю выборку.
+    """
+    sql = ("SELECT student_id, direction, event_time, device_id, serial_no FROM events "
+           "WHERE event_time BETWEEN ? AND ?")
+    params = [start.isoformat(), end.isoformat()]
+    if student_id:
+        sql += " AND student_id = ?"
+        params.append(student_id)
+    cur = get_conn().execute(sql + " ORDER BY event_time", params)
+    while True:
+        rows = cur.fetchmany(chunk)
+        if not rows:
+            break
+        yield rows
+
+def query_student_events(student_id, start, end):
+    """
+    События студента за период, по возрастанию времени: [(direction, event_time), ...]
+    """
+    cur = get_conn().execute(
+        "SELECT direction, event_time FROM events "
+        "WHERE student_id = ? AND event_time >= ? AND event_time < ? "
+        "ORDER BY event_time",
+        (student_id, start.isoformat(), end.isoformat())
+    )
+    return cur.fetchall()
+
+def query_student_history(student_id, before=None, after=None, limit=HISTORY_PAGE):
+    """
+    Страница истории студента (keyset по (event_time, rowid)), новые сверху.
+    before / after: (event_time, rowid) — граница соседней страницы.
+    Возвращает (rows, has_older, has_newer), rows: [(rowid, direction, event_time), ...]
+    """
+    conn = get_conn()
+    base = "SELECT rowid, direction, event_time FROM events WHERE student_id = ?"
+    if after:
+        rows = conn.execute(
+            base + " AND (event_time, rowid) > (?, ?) ORDER BY event_time, rowid LIMIT ?",
+            (student_id, *after, limit + 1)
+        ).fetchall()
+        has_newer = len(rows) > limit
+        rows = rows[:limit][::-1]
+        has_older = True
+    else:
+        if before:
+            sql, params = base + " AND (event_time, rowid) < (?, ?)", (student_id, *before)
+        else:
+            sql, params = base, (student_id,)
+        rows = conn.execute(
+            sql + " ORDER BY event_time DESC, rowid DESC LIMIT ?", (*params, limit + 1)
+        ).fetchall()
+        has_older = len(rows) > limit
+        rows = rows[:limit]
+        has_newer = before is not None
+    if rows and has_older and after:
+        has_older = conn.execute(
+            "SELECT 1 FROM events WHERE student_id = ? AND (event_time, rowid) < (?, ?) LIMIT 1",
+            (student_id, rows[-1][2], rows[-1][0])
+        ).fetchone() is not None
+    if rows and has_newer and before:
+        has_newer = conn.execute(
+            "SELECT 1 FROM events WHERE student_id = ? AND (event_time, rowid) > (?, ?) LIMIT 1",
+            (student_id, rows[0][2], rows[0][0])
+        ).fetchone() is not None
+    return rows, has_older, has_newer
+
+def add_traces(rows):
+    """
+    rows: [(event_id, chat_id, fetched, committed, enqueued, send_start, acked, attempts), ...]
+    """
+    with transaction() as cur:
+        cur.executemany("REPLACE INTO event_trace VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+def prune_traces(before_ms: int) -> int:
+    """
+    Удалить трассы старше before_ms (unix-мс: запись в БД или постановка в очередь).
+    Возвращает число удалённых строк.
+    """
+    with transaction() as cur:
+        cur.execute("DELETE FROM event_trace WHERE COALESCE(committed, enqueued) < ?", (before_ms,))
+        return cur.rowcount
+
+def query_traces(student_id, start, end):
+    """
+    Трассы событий студента за период, по времени события:
+    [(event_id, event_time, device_id, chat_id, fetched, committed,
+      enqueued, send_start, acked, attempts), ...]
+    """
+    cur = get_conn().execute(
+        "SELECT e.rowid, e.event_time, e.device_id, t.chat_id, t.fetched, t.committed, "
+        "       t.enqueued, t.send_start, t.acked, t.attempts "
+        "FROM events e JOIN event_trace t ON t.event_id = e.rowid "
+        "WHERE e.student_id = ? AND e.event_time >= ? AND e.event_time < ? "
+        # строка приёма (chat_id = 0) первой: у групповых чатов id отрицательные
+        "ORDER BY e.event_time, e.rowid, t.chat_id != 0, t.chat_id",
+        (student_id, start.isoformat(), end.isoformat())
+    )
+    return cur.fetchall()
+
+def query_student_daily(student_id, start, end):
+    """
+    Первый вход и последний выход студента по дням:
+    { 'YYYY-MM-DD': (first_in | None, last_out | None), ... }
+    """
+    cur = get_conn().execute(
+        "SELECT day, first_in, last_out FROM daily_attendance "
+        "WHERE student_id = ? AND day BETWEEN ? AND ?",
+        (student_id, start.date().isoformat(), end.date().isoformat())
+    )
+    return {r[0]: (r[1], r[2]) for r in cur.fetchall()}
+
+def summary_by_day(start_day, end_day):
+    """
+    Сводка по дням: [(day, present, late), ...] — только студенты из students
+    (турникет отдаёт и сотрудников, и гостей), чтобы сходилось с count_students()
+    """
+    cur = get_conn().execute(
+        "SELECT day, COUNT(first_in), SUM(late) FROM daily_attendance "
+        "WHERE day BETWEEN ? AND ? AND student_id IN (SELECT student_id FROM students) "
+        "GROUP BY day ORDER BY day",
+        (start_day.isoformat(), end_day.isoformat())
+    )
+    return cur.fetchall()
+
+def summary_by_student(student_ids, start_day, end_day):
+    """
+    Сводка по студентам за дни [start_day, end_day]:
+    { student_id: (days_present, days_late), ... } — только для student_ids
+    """
+    if not student_ids:
+        return {}
+    marks = ", ".join("?" * len(student_ids))
+    cur = get_conn().execute(
+        f"SELECT student_id, COUNT(first_in), SUM(late) FROM daily_attendance "
+        f"WHERE student_id IN ({marks}) AND day BETWEEN ? AND ? "
+        f"GROUP BY student_id",
+        (*student_ids, start_day.isoformat(), end_day.isoformat())
+    )
+    return {r[0]: (r[1], r[2]) for r in cur.fetchall()}
+
+STUDENT_COLUMNS = ("student_id", "name", "birthdate", "registration_code", "telegram_chat_id")
+
+def _import_students(cur, path):
+    with open(path, "r", encoding="utf-8") as f:
+        students = json.load(f)
+    cur.executemany(
+        "INSERT INTO students(student_id, name, birthdate, registration_code, telegram_chat_id) "
+        "VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(student_id) DO UPDATE SET "
+        "    name = excluded.name, birthdate = excluded.birthdate, "
+        "    registration_code = excluded.registration_code, "
+        "    telegram_chat_id = COALESCE(students.telegram_chat_id, excluded.telegram_chat_id)",
+        [tuple(s.get(c) for c in STUDENT_COLUMNS) for s in students]
+    )
+    return len(students)
+
+def import_students(path=STUDENTS_FILE):
+    """
+    Импорт (upsert) студентов из JSON-файла прежнего формата, возвращает их число.
+    Уже привязанный telegram_chat_id не затирается.
+    """
+    with transaction() as cur:
+        return _import_students(cur, path)
+
+def _student_row(row):
+    return dict(zip(STUDENT_COLUMNS, row)) if row else None
+
+def get_student(student_id):
+    row = get_conn().execute(
+        "SELECT student_id, name, birthdate, registration_code, telegram_chat_id "
+        "FROM students WHERE student_id = ?", (student_id,)
+    ).fetchone()
+    return _student_row(row)
+
+def get_student_by_code(code):
+    row = get_conn().execute(
+        "SELECT student_id, name, birthdate, registration_code, telegram_chat_id "
+        "FROM students WHERE registration_code = ?", (code,)
+    ).fetchone()
+    return _student_row(row)
+
+def load_students():
+    rows = get_conn().execute(
+        "SELECT student_id, name, birthdate, registration_code, telegram_chat_id "
+        "FROM students ORDER BY student_id"
+    ).fetchall()
+    return [_student_row(r) for r in rows]
+
+def count_students():
+    return get_conn().execute("SELECT COUNT(*) FROM students").fetchone()[0]
+
+def student_ids_page(offset, limit):
+    """student_id по порядку, страница [offset, offset + limit)."""
+    rows = get_conn().execute(
+        "SELECT student_id FROM students ORDER BY student_id LIMIT ? OFFSET ?",
+        (limit, offset)
+    ).fetchall()
+    return [r[0] for r in rows]
+
+def link_student_chat(code, chat_id):
+    """
+    Привязывает чат к студенту по коду регистрации, если он ещё не привязан.
+    Возвращает имя студента или None.
+    """
+    with transaction() as cur:
+        cur.execute(
+            "UPDATE students SET telegram_chat_id = ? "
+            "WHERE registration_code = ? AND telegram_chat_id IS NULL",
+            (chat_id, code)
+        )
+        if not cur.rowcount:
+            return None
+        row = cur.execute("SELECT name FROM students WHERE registration_code = ?", (code,)).fetchone()
+    return row[0]
+
+def _subs_load():
+    global _subscribers
+    subs = {}
+    for p in load_parents():
+        if p["student_id"]:
+            subs.setdefault(p["student_id"], {})[p["chat_id"]] = p
+    _subscribers = subs
+    _subscriber_of.clear()
+    _subscriber_of.update({c: sid for sid, chats in subs.items() for c in chats})
+
+def _subs_refresh(chat_id):
+    """
+    Переносит родителя в индексе подписчиков после изменения его строки.
+    """
+    row = get_conn().execute(
+        "SELECT chat_id, student_id, entry_on, exit_on, late_on, digest FROM parents WHERE chat_id = ?",
+        (chat_id,)
+    ).fetchone()
+    with _subs_lock:
+        if _subscribers is None:
+            return
+        old_sid = _subscriber_of.pop(chat_id, None)
+        if old_sid is not None:
+            _subscribers.get(old_sid, {}).pop(chat_id, None)
+        if row and row[1]:
+            _subscribers.setdefault(row[1], {})[chat_id] = {
+                "chat_id":    row[0],
+                "student_id": row[1],
+                "entry_on":   bool(row[2]),
+                "exit_on":    bool(row[3]),
+                "late_on":    bool(row[4]),
+                "digest":     row[5] or "",
+            }
+            _subscriber_of[chat_id] = row[1]
+
+def get_subscribers(student_id):
+    """
+    Все родители, подписанные на студента:
+    [{ 'chat_id':..., 'student_id':..., 'entry_on':..., 'exit_on':..., 'late_on':..., 'digest':... }, ...]
+    """
+    with _subs_lock:
+        if _subscribers is None:
+            _subs_load()
+        return list(_subscribers.get(student_id, {}).values())
+
+def _parent_cache_put(chat_id, parent):
+    with _parent_lock:
+        _parent_cache[chat_id] = parent
+        _parent_cache.move_to_end(chat_id)
+        while len(_parent_cache) > PARENT_CACHE_SIZE:
+            _parent_cache.popitem(last=False)
+
+def _parent_cache_drop(chat_id):
+    with _parent_lock:
+        _parent_cache.pop(chat_id, None)
+
+def parent_cache_info():
+    """Счётчики кэша профилей родителей: hits, misses, size."""
+    return {**_parent_stats, "size": len(_parent_cache)}
 
 def add_parent(chat_id, name, phone, student_id, language):
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("""
-        REPLACE INTO parents(chat_id, name, phone, student_id, language)
-        VALUES (?, ?, ?, ?, ?)
-    """, (chat_id, name, phone, student_id, language))
-    conn.commit()
-    conn.close()
+    with transaction() as cur:
+        cur.execute("""
+            REPLACE INTO parents(chat_id, name, phone, student_id, language)
+            VALUES (?, ?, ?, ?, ?)
+        """, (chat_id, name, phone, student_id, language))
+    _parent_cache_drop(chat_id)
+    _subs_refresh(chat_id)
 
 def get_parent(chat_id):
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("""
+    with _parent_lock:
+        if chat_id in _parent_cache:
+            _parent_stats["hits"] += 1
+            _parent_cache.move_to_end(chat_id)
+            parent = _parent_cache[chat_id]
+            return dict(parent) if parent else None
+        _parent_stats["misses"] += 1
+
+    row = get_conn().execute("""
         SELECT chat_id, name, phone, student_id, language,
-               entry_on, exit_on, late_on
+               entry_on, exit_on, late_on, digest
         FROM parents WHERE chat_id = ?
-    """, (chat_id,))
-    row = cur.fetchone()
-    conn.close()
+    """, (chat_id,)).fetchone()
     if not row:
+        _parent_cache_put(chat_id, None)
         return None
-    return {
+    parent = {
         "chat_id":    row[0],
         "name":       row[1],
         "phone":      row[2],
@@ -84,40 +646,62 @@ def get_parent(chat_id):
         "entry_on":   bool(row[5]),
         "exit_on":    bool(row[6]),
         "late_on":    bool(row[7]),
+        "digest":     row[8] or "",
     }
+    _parent_cache_put(chat_id, parent)
+    return dict(parent)
 
 def update_parent_field(chat_id, field, value):
     if field not in ("name", "phone", "student_id", "language"):
         return
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute(f"UPDATE parents SET {field} = ? WHERE chat_id = ?", (value, chat_id))
-    conn.commit()
-    conn.close()
+    with transaction() as cur:
+        cur.execute(f"UPDATE parents SET {field} = ? WHERE chat_id = ?", (value, chat_id))
+    with _parent_lock:
+        if _parent_cache.get(chat_id):
+            _parent_cache[chat_id][field] = value
+    if field == "student_id":
+        _subs_refresh(chat_id)
 
 def toggle_notification(chat_id, field):
     if field not in ("entry_on", "exit_on", "late_on"):
         return
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute(f"UPDATE parents SET {field} = 1 - {field} WHERE chat_id = ?", (chat_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as cur:
+        cur.execute(f"UPDATE parents SET {field} = 1 - {field} WHERE chat_id = ?", (chat_id,))
+    with _parent_lock:
+        if _parent_cache.get(chat_id):
+            _parent_cache[chat_id][field] = not _parent_cache[chat_id][field]
+    _subs_refresh(chat_id)
+
+def cycle_digest(chat_id):
+    """
+    Переключает режим сводки родителя по кругу DIGEST_MODES.
+    """
+    parent = get_parent(chat_id)
+    if not parent:
+        return
+    mode = DIGEST_MODES[(DIGEST_MODES.index(parent["digest"]) + 1) % len(DIGEST_MODES)]
+    with transaction() as cur:
+        cur.execute("UPDATE parents SET digest = ? WHERE chat_id = ?", (mode, chat_id))
+    with _parent_lock:
+        if _parent_cache.get(chat_id):
+            _parent_cache[chat_id]["digest"] = mode
+    _subs_refresh(chat_id)
 
 def register_admin(chat_id, code):
     from config import ADMIN_CODES
     return code in ADMIN_CODES
 
-def load_parents():
+def load_parents(digest=None):
     """
-    Возвращает список словарей:
-    [{ 'chat_id':..., 'student_id':..., 'entry_on':..., 'exit_on':..., 'late_on':... }, ...]
+    Возвращает список словарей (только с режимом сводки digest, если задан):
+    [{ 'chat_id':..., 'student_id':..., 'entry_on':..., 'exit_on':..., 'late_on':..., 'digest':... }, ...]
     """
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("SELECT chat_id, student_id, entry_on, exit_on, late_on FROM parents")
-    rows = cur.fetchall()
-    conn.close()
+    sql = "SELECT chat_id, student_id, entry_on, exit_on, late_on, digest FROM parents"
+    params = ()
+    if digest is not None:
+        sql += " WHERE digest = ?"
+        params = (digest,)
+    rows = get_conn().execute(sql, params).fetchall()
     return [
         {
             "chat_id":    r[0],
@@ -125,6 +709,19 @@ def load_parents():
             "entry_on":   bool(r[2]),
             "exit_on":    bool(r[3]),
             "late_on":    bool(r[4]),
+            "digest":     r[5] or "",
         }
         for r in rows
     ]
+
+if __name__ == "__main__":
+    import sys
+    # python db.py rebuild [YYYY-MM-DD] — пересчёт посещаемости после загрузки истории
+    # python db.py import-students [students.json] — перенос списка студентов в SQLite
+    if sys.argv[1:2] == ["import-students"]:
+        init_db()
+        print("students imported:", import_students(sys.argv[2] if len(sys.argv) > 2 else STUDENTS_FILE))
+    if sys.argv[1:2] == ["rebuild"]:
+        init_db()
+        rebuild_daily_attendance(sys.argv[2] if len(sys.argv) > 2 else None)
+        print("daily_attendance rebuilt")
@@ -0,0 +1,125 @@
+# device_simulator.py
+# Локальная замена турникета Hikvision для проверки без оборудования:
+#   GET  /ISAPI/Event/notification/alertStream  — multipart-поток событий
+#   POST /ISAPI/AccessControl/AcsEvent          — постраничный поиск событий
+#
+# Запуск: python device_simulator.py [port] [интервал_сек]
+# В config.DEVICES: {"id": "sim", "host": "127.0.0.1", "port": 8000, ...}
+
+import json
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import db
+from utils import load_students
+
+BOUNDARY = "MIME_boundary"
+HEARTBEAT = 10  # секунд между heartbeat-частями
+
+# Журнал всех сгенерированных событий (для AcsEvent)
+_log: list[dict] = []
+_log_lock = threading.Lock()
+_serial = 0
+
+def make_event() -> dict:
+    global _serial
+    with _log_lock:
+        _serial += 1
+        student = random.choice(load_students())
+        ev = {
+            "major":            5,
+            "minor":            75,
+            "time":             datetime.now().astimezone().isoformat(timespec="seconds"),
+            "employeeNoString": student["student_id"],
+            "name":             student["name"],
+            "serialNo":         _serial,
+            "attendanceStatus": random.choice(("checkIn", "checkOut")),
+        }
+        _log.append(ev)
+        return ev
+
+def alert_part(payload: dict) -> bytes:
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    return (
+        f"--{BOUNDARY}\r\n"
+        f"Content-Type: application/json; charset=\"UTF-8\"\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n"
+    ).encode() + body + b"\r\n"
+
+class DeviceHandler(BaseHTTPRequestHandler):
+    interval = 2.0
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        if not self.path.startswith("/ISAPI/Event/notification/alertStream"):
+            return self.send_error(404)
+        self.send_response(200)
+        self.send_header("Content-Type", f"multipart/mixed; boundary={BOUNDARY}")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        last_beat = time.monotonic()
+        try:
+            while True:
+                time.sleep(self.interval)
+                ev = make_event()
+                self.wfile.write(alert_part({
+                    "ipAddress": "127.0.0.1",
+                    "dateTime":  ev["time"],
+                    "eventType": "AccessControllerEvent",
+                    "AccessControllerEvent": {
+                        "majorEventType":   ev["major"],
+                        "subEventType":     ev["minor"],
+                        "employeeNoString": ev["employeeNoString"],
+                        "serialNo":         ev["serialNo"],
+                        "attendanceStatus": ev["attendanceStatus"],
+                    },
+                }))
+                if time.monotonic() - last_beat > HEARTBEAT:
+                    self.wfile.write(alert_part({"eventType": "videoloss", "eventState": "inactive"}))
+                    last_beat = time.monotonic()
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        if not self.path.startswith("/ISAPI/AccessControl/AcsEvent"):
+            return self.send_error(404)
+        length = int(self.headers.get("Content-Length", 0))
+        cond = json.loads(self.rfile.read(length))["AcsEventCond"]
+        start = datetime.fromisoformat(cond["startTime"])
+        end = datetime.fromisoformat(cond["endTime"])
+        with _log_lock:
+            matches = [ev for ev in _log if start <= datetime.fromisoformat(ev["time"]) <= end]
+        pos, size = cond["searchResultPosition"], cond["maxResults"]
+        page = matches[pos:pos + size]
+        body = json.dumps({"AcsEvent": {
+            "searchID":           cond["searchID"],
+            "responseStatusStrg": "MORE" if pos + size < len(matches) else ("OK" if matches else "NO MATCH"),
+            "numOfMatches":       len(page),
+            "totalMatches":       len(matches),
+            "InfoList":           page,
+        }}, ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(port: int = 8000, interval: float = 2.0) -> ThreadingHTTPServer:
+    DeviceHandler.interval = interval
+    server = ThreadingHTTPServer(("127.0.0.1", port), DeviceHandler)
+    server.daemon_threads = True
+    return server
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    db.init_db()
+    print(f"Device simulator on http://127.0.0.1:{port}/ISAPI")
+    serve(port, interval).serve_forever()
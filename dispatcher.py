@@ -0,0 +1,179 @@
+# dispatcher.py
+# Очередь уведомлений с учётом лимитов Telegram:
+# ~30 сообщений/с на бота и ~1 сообщение/с в один чат.
+
+import asyncio
+import time
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+import metrics
+import tracing
+
+GLOBAL_RATE   = 30   # сообщений в секунду на бота
+PER_CHAT_RATE = 1    # сообщений в секунду в один чат
+WORKERS       = 8    # параллельных отправителей
+MAX_RETRIES   = 3
+RETRY_BACKOFF = 1    # секунд до повтора после сетевой ошибки, удваивается с каждой попыткой
+
+class TokenBucket:
+    """
+    Ведро токенов: не больше rate операций в секунду, всплеск до capacity.
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class Dispatcher:
+    """
+    Очередь сообщений и N воркеров, отправляющих их через общий Bot.
+    """
+    def __init__(self, bot: Bot, workers: int = WORKERS,
+                 global_rate: float = GLOBAL_RATE, per_chat_rate: float = PER_CHAT_RATE):
+        self.bot = bot
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.bucket = TokenBucket(global_rate)
+        self.per_chat_interval = 1 / per_chat_rate
+        self.workers = workers
+        self._chat_next: dict[int, float] = {}  # chat_id -> когда можно слать следующее
+        self._paused_until = 0.0                # глобальная пауза после RetryAfter
+        self._tasks: list[asyncio.Task] = []
+
+    def enqueue(self, chat_id: int, text: str, trace: tuple = (), **kwargs):
+        """trace — id трассируемых событий, о которых это сообщение."""
+        if trace:
+            tracing.enqueued(trace, chat_id)
+        self.queue.put_nowait((chat_id, text, kwargs, 0, trace))
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10):
+        """Дождаться отправки очереди (не дольше timeout) и остановить воркеров."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Dispatcher: не отправлено {self.queue.qsize()} сообщений")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _wait_chat_slot(self, chat_id: int):
+        now = time.monotonic()
+        ready = self._chat_next.get(chat_id, 0.0)
+        # резервируем слот до await, чтобы два воркера не взяли один и тот же
+        self._chat_next[chat_id] = max(now, ready) + self.per_chat_interval
+        if ready > now:
+            await asyncio.sleep(ready - now)
+
+    def _requeue(self, item: tuple):
+        # отложенный повтор: сначала в очередь, потом task_done исходной попытки,
+        # чтобы queue.join() в stop() не завершился раньше
+        self.queue.put_nowait(item)
+        self.queue.task_done()
+
+    def _prune_chats(self):
+        if len(self._chat_next) > 10000:
+            now = time.monotonic()
+            self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+
+    async def _worker(self):
+        while True:
+            chat_id, text, kwargs, attempt, trace = await self.queue.get()
+            retry_in = None
+            try:
+                await self._wait_chat_slot(chat_id)
+                await self.bucket.acquire()
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                if trace:
+                    tracing.send_start(trace, chat_id)
+                t0 = time.perf_counter()
+                await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                metrics.SEND.observe(time.perf_counter() - t0)
+                metrics.SENT.inc(1, "ok")
+                if trace:
+                    tracing.delivered(trace, chat_id)
+            except RetryAfter as e:
+                # Telegram просит подождать — притормаживаем всех воркеров
+                metrics.SENT.inc(1, "retry_after")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                if attempt < MAX_RETRIES:
+                    self.queue.put_nowait((chat_id, text, kwargs, attempt + 1, trace))
+                else:
+                    print(f"Dispatcher: отказ после {attempt + 1} попыток, chat {chat_id}")
+                    tracing.delivered(trace, chat_id, ok=False)
+            except Forbidden as e:
+                # бот заблокирован пользователем — повторять бессмысленно
+                metrics.SENT.inc(1, "forbidden")
+                tracing.delivered(trace, chat_id, ok=False)
+                print(f"Dispatcher: chat {chat_id} недоступен: {e}")
+            except BadRequest as e:
+                # в PTB это подкласс NetworkError, но ошибка постоянная
+                # (чат не найден, длинный текст, разметка) — не повторяем
+                metrics.SENT.inc(1, "error")
+                tracing.delivered(trace, chat_id, ok=False)
+                print(f"Dispatcher: chat {chat_id} отклонил сообщение: {e}")
+            except NetworkError as e:
+                # таймаут/обрыв (TimedOut — тоже NetworkError): повторяем с паузой,
+                # не занимая воркера
+                metrics.SENT.inc(1, "network")
+                if attempt < MAX_RETRIES:
+                    retry_in = RETRY_BACKOFF * 2 ** attempt
+                else:
+                    print(f"Dispatcher: сеть недоступна после {attempt + 1} попыток, chat {chat_id}: {e}")
+                    tracing.delivered(trace, chat_id, ok=False)
+            except TelegramError as e:
+                metrics.SENT.inc(1, "error")
+                tracing.delivered(trace, chat_id, ok=False)
+                print(f"Ошибка отправки уведомления: {e}")
+            except Exception as e:
+                # что угодно ещё не должно останавливать воркера
+                metrics.SENT.inc(1, "error")
+                tracing.delivered(trace, chat_id, ok=False)
+                print(f"Dispatcher: непредвиденная ошибка, chat {chat_id}: {e!r}")
+            finally:
+                if retry_in is None:
+                    self.queue.task_done()
+                else:
+                    asyncio.get_running_loop().call_later(
+                        retry_in, self._requeue, (chat_id, text, kwargs, attempt + 1, trace))
+                self._prune_chats()
+
+# Общий диспетчер приложения
+_dispatcher: Dispatcher | None = None
+
+def start(bot: Bot, **kwargs) -> Dispatcher:
+    """Создать и запустить диспетчер (из post_init)."""
+    global _dispatcher
+    _dispatcher = Dispatcher(bot, **kwargs)
+    _dispatcher.start()
+    return _dispatcher
+
+def enqueue(chat_id: int, text: str, **kwargs):
+    """Поставить сообщение в очередь на отправку."""
+    if _dispatcher is None:
+        raise RuntimeError("dispatcher is not started")
+    _dispatcher.enqueue(chat_id, text, **kwargs)
+
+async def shutdown():
+    """Отправить оставшееся и остановить воркеров."""
+    global _dispatcher
+    if _dispatcher:
+        await _dispatcher.stop()
+        _dispatcher = None
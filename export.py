@@ -0,0 +1,24 @@
+# export.py
+# Потоковая выгрузка событий в CSV (опционально gzip):
+# строки читаются курсором порциями и сразу пишутся в файл.
+
+import csv
+import gzip
+import db
+
+HEADER = ("student_id", "direction", "event_time", "device_id", "serial_no")
+
+def export_events(path, start, end, student_id=None, gz=False) -> int:
+    """
+    Пишет события за период в CSV-файл path, возвращает число строк.
+    Вызывать из отдельного потока (asyncio.to_thread) — у потока своё соединение.
+    """
+    opener = gzip.open if gz else open
+    count = 0
+    with opener(path, "wt", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for rows in db.iter_events(start, end, student_id):
+            writer.writerows(rows)
+            count += len(rows)
+    return count
@@ -0,0 +1,169 @@
+# fake_telegram.py
+# Локальная замена Telegram Bot API для нагрузочных тестов без сети:
+#   getMe, getUpdates (long polling), deleteWebhook, sendMessage,
+#   editMessageText, answerCallbackQuery, sendDocument
+# с искусственной задержкой и ошибками 429 (RetryAfter) / 403 (бот заблокирован).
+#
+# Запуск: python fake_telegram.py [--port 8081] [--latency 50] [--p429 0.01] [--p403 0.001]
+# и в config.py: BOT_API_BASE_URL = "http://127.0.0.1:8081/bot"
+
+import argparse
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import default as email_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Методы, на которые отвечает пользователю хэндлер (для замера задержки)
+REPLY_METHODS = ("sendMessage", "editMessageText", "sendDocument")
+
+class FakeTelegram:
+    """
+    Состояние сервера: очередь входящих апдейтов, журнал вызовов, параметры сбоев.
+    """
+    def __init__(self, latency: float = 0.0, p429: float = 0.0, p403: float = 0.0,
+                 retry_after: int = 1):
+        self.latency = latency          # секунд на ответ
+        self.p429 = p429
+        self.p403 = p403
+        self.retry_after = retry_after
+        self.updates: list[dict] = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.calls: dict[str, int] = {}
+        self.errors: dict[int, int] = {}
+        self.listeners = []  # fn(method, params, status) — вызываются из потоков сервера
+        self._cond = threading.Condition()
+
+    def push_update(self, update: dict) -> int:
+        with self._cond:
+            update_id = self.next_update_id
+            self.next_update_id += 1
+            self.updates.append({"update_id": update_id, **update})
+            self._cond.notify_all()
+        return update_id
+
+    def get_updates(self, offset: int, timeout: float) -> list[dict]:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                # offset подтверждает всё, что меньше него
+                self.updates = [u for u in self.updates if u["update_id"] >= offset]
+                if self.updates:
+                    return list(self.updates[:100])
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return []
+                self._cond.wait(left)
+
+    def _message(self, params: dict, **extra) -> dict:
+        with self._cond:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        return {
+            "message_id": int(params.get("message_id") or message_id),
+            "date":       int(time.time()),
+            "chat":       {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "text":       params.get("text", ""),
+            **extra,
+        }
+
+    def call(self, method: str, params: dict) -> tuple[int, dict]:
+        with self._cond:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == "getUpdates":
+            result = self.get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))
+            return 200, {"ok": True, "result": result}
+
+        if self.latency:
+            time.sleep(self.latency)
+        status, body = 200, None
+        if method not in ("getMe", "deleteWebhook", "getUpdates"):
+            roll = random.random()
+            if roll < self.p429:
+                status, body = 429, {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+            elif roll < self.p429 + self.p403:
+                status, body = 403, {
+                    "ok": False, "error_code": 403,
+                    "description": "Forbidden: bot was blocked by the user",
+                }
+        if body is None:
+            if method == "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+            elif method in ("sendMessage", "editMessageText"):
+                result = self._message(params)
+            elif method == "sendDocument":
+                result = self._message(params, document={"file_id": "doc", "file_unique_id": "doc"})
+            else:
+                result = True
+            body = {"ok": True, "result": result}
+        else:
+            with self._cond:
+                self.errors[status] = self.errors.get(status, 0) + 1
+
+        for listener in self.listeners:
+            listener(method, params, status)
+        return status, body
+
+def _parse_params(content_type: str, raw: bytes) -> dict:
+    if content_type.startswith("application/json"):
+        return json.loads(raw or b"{}")
+    if content_type.startswith("multipart/form-data"):
+        msg = BytesParser(policy=email_policy).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + raw
+        )
+        params = {}
+        for part in msg.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name and not part.get_filename():
+                params[name] = part.get_content()
+        return params
+    return {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+
+def serve(fake: FakeTelegram, port: int = 8081) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # заголовки и тело уходят отдельными write: без этого Nagle + delayed ACK дают +40 мс
+        disable_nagle_algorithm = True
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _handle(self):
+            # /bot<token>/<method>
+            method = self.path.rstrip("/").rsplit("/", 1)[-1].split("?")[0]
+            raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            params = _parse_params(self.headers.get("Content-Type", ""), raw)
+            status, body = fake.call(method, params)
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = _handle
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    return server
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--latency", type=float, default=0, help="задержка ответа, мс")
+    ap.add_argument("--p429", type=float, default=0, help="доля ответов 429 RetryAfter")
+    ap.add_argument("--p403", type=float, default=0, help="доля ответов 403 Forbidden")
+    ap.add_argument("--retry-after", type=int, default=1)
+    args = ap.parse_args()
+    fake = FakeTelegram(args.latency / 1000, args.p429, args.p403, args.retry_after)
+    print(f"Fake Bot API on http://127.0.0.1:{args.port}/bot")
+    serve(fake, args.port).serve_forever()
@@ -0,0 +1,257 @@
+# handler_bench.py
+# Микробенчмарк хэндлеров без сети: собирает Application из
+# handlers.get_handlers() с заглушкой Bot API, прогоняет синтетические
+# Update (регистрация, меню родителя, админ-сводки, выгрузка) через
+# Application.process_update и меряет CPU-время и число SQL-запросов
+# на каждый шаг. С --baseline завершается с кодом 1 при регрессии.
+#
+# Запуск: python handler_bench.py --iterations 50 [--save bench.json | --baseline bench.json]
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import warnings
+from itertools import count
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, ConversationHandler
+from telegram.request import BaseRequest
+
+import benchmark
+import db
+import fake_telegram
+import loadtest
+from config import ADMIN_CODES, BOT_TOKEN
+from handlers import get_handlers
+from timing import all_handlers, describe, instrument
+
+# Чаты: новые родители для регистрации и отдельный админ
+REG_CHAT_BASE = 5 * 10**9
+ADMIN_CHAT = 4 * 10**9
+
+class StubRequest(BaseRequest):
+    """
+    Отвечает на вызовы Bot API из fake_telegram.FakeTelegram без HTTP.
+    """
+    def __init__(self):
+        self.fake = fake_telegram.FakeTelegram()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        params = request_data.json_parameters if request_data else {}
+        status, body = self.fake.call(url.rsplit("/", 1)[-1], params)
+        return status, json.dumps(body).encode()
+
+# Application не запущен (нет updater) — задачи block=False дожидаемся сами
+warnings.filterwarnings("ignore", message="Tasks created via `Application.create_task`")
+
+_ids = count(1)
+
+def message(chat_id: int, text: str) -> dict:
+    msg = {
+        "message_id": next(_ids),
+        "date":       int(time.time()),
+        "chat":       {"id": chat_id, "type": "private"},
+        "from":       {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+        "text":       text,
+    }
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_ids), "message": msg}
+
+def callback(chat_id: int, data: str) -> dict:
+    return {"update_id": next(_ids), "callback_query": {
+        "id":            str(next(_ids)),
+        "from":          {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+        "chat_instance": str(chat_id),
+        "data":          data,
+        "message":       {"message_id": 1, "date": int(time.time()),
+                          "chat": {"id": chat_id, "type": "private"}, "text": "menu"},
+    }}
+
+def scenario(i: int, ids: list[str], parents: list[int]) -> list[tuple[str, dict]]:
+    """
+    Шаги одной итерации: (метка, update).
+    """
+    new_chat = REG_CHAT_BASE + i
+    parent = random.choice(parents)
+    sid = random.choice(ids)
+    rows, _, _ = db.query_student_history(sid)
+    hist = f"hist|o|{rows[-1][0]}" if rows else "hist|o|0"
+    steps = [
+        # регистрация
+        ("/start",          message(new_chat, "/start")),
+        ("lang_en",         callback(new_chat, "lang_en")),
+        ("reg name",        message(new_chat, "Bench Parent")),
+        ("reg phone",       message(new_chat, "+998901234567")),
+        ("reg student",     message(new_chat, sid)),
+        # меню родителя
+        ("p_profile",       callback(parent, "p_profile")),
+        ("p_att",           callback(parent, "p_att")),
+        ("📆",              message(parent, "📆 Attendance")),
+        ("p_notif",         callback(parent, "p_notif")),
+        ("toggle_entry_on", callback(parent, "toggle_entry_on")),
+        ("toggle_digest",   callback(parent, "toggle_digest")),
+        ("back_parent",     callback(parent, "back_parent")),
+        # админ
+        ("/admin",          message(ADMIN_CHAT, "/admin")),
+        ("admin code",      message(ADMIN_CHAT, sorted(ADMIN_CODES)[0])),
+        ("summary",         callback(ADMIN_CHAT, "summary")),
+        ("summary_1",       callback(ADMIN_CHAT, "summary_1")),
+        ("summary_30",      callback(ADMIN_CHAT, "summary_30")),
+        ("summary_30_1",    callback(ADMIN_CHAT, "summary_30_1")),
+        ("student_info",    callback(ADMIN_CHAT, "student_info")),
+        ("student id",      message(ADMIN_CHAT, sid)),
+        ("hist|older",      callback(ADMIN_CHAT, hist)),
+        ("student_info ⟲",  callback(ADMIN_CHAT, "student_info")),
+        ("back from info",  callback(ADMIN_CHAT, "back_admin")),
+        ("export",          callback(ADMIN_CHAT, "export")),
+        ("export_7",        callback(ADMIN_CHAT, "export_7")),
+        ("/export",         message(ADMIN_CHAT, f"/export 1970-01-01 2100-01-01 {sid}")),
+        ("/timings",        message(ADMIN_CHAT, "/timings")),
+        ("/trace",          message(ADMIN_CHAT, f"/trace {sid}")),
+        ("back_admin",      callback(ADMIN_CHAT, "back_admin")),
+    ]
+    return steps
+
+def match_handler(handlers: list, update: Update):
+    """
+    Хэндлер, который PTB выберет для update (внутри ConversationHandler —
+    хэндлер текущего состояния), или None.
+    """
+    for handler in handlers:
+        check = handler.check_update(update)
+        if check is None or check is False:
+            continue
+        if isinstance(handler, ConversationHandler):
+            return check[2]
+        return handler
+    return None
+
+async def run(args) -> dict:
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="facepass_hbench_")
+    db.DB_FILE = os.path.join(workdir, "hbench.db")
+    db.STUDENTS_FILE = os.path.join(workdir, "none.json")
+    db.init_db()
+    ids, _ = benchmark.seed(args.students, 0)
+    loadtest.seed_history(ids, args.history_days)
+    parents = [p["chat_id"] for p in db.load_parents()]
+    db.add_parent(ADMIN_CHAT, name="Admin", phone="", student_id="", language="en")
+
+    request = StubRequest()
+    app = (ApplicationBuilder().token(BOT_TOKEN)
+           .request(request).get_updates_request(StubRequest()).build())
+    # как в bot.build_app: хэндлеры обёрнуты замером времени
+    for handler in instrument(get_handlers()):
+        app.add_handler(handler)
+    handlers = app.handlers[0]
+    await app.initialize()
+
+    stats: dict[str, dict] = {}
+    covered = set()
+    for i in range(args.warmup + args.iterations):
+        for label, data in scenario(i, ids, parents):
+            update = Update.de_json(data, app.bot)
+            handler = match_handler(handlers, update)
+            covered.add(id(handler))
+            calls_before = sum(request.fake.calls.values())
+            with db.count_queries() as queries:
+                cpu0, wall0 = time.process_time(), time.perf_counter()
+                await app.process_update(update)
+                # неблокирующие хэндлеры (выгрузка) работают отдельными задачами — дожидаемся
+                await asyncio.gather(*(asyncio.all_tasks() - {asyncio.current_task()}))
+                cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+            if i < args.warmup:
+                continue
+            entry = stats.setdefault(label, {
+                "handler": describe(handler) if handler else "—",
+                "cpu": [], "wall": [], "db_queries": 0, "api_calls": 0,
+            })
+            entry["cpu"].append(cpu)
+            entry["wall"].append(wall)
+            entry["db_queries"] += queries[0]
+            entry["api_calls"] += sum(request.fake.calls.values()) - calls_before
+
+    await app.shutdown()
+    db.close()
+
+    result = {}
+    for label, entry in stats.items():
+        n = len(entry["cpu"])
+        result[label] = {
+            "handler":     entry["handler"],
+            "cpu_ms":      round(sum(entry["cpu"]) / n * 1000, 3),
+            "wall_p99_ms": round(benchmark.percentile(sorted(entry["wall"]), 99) * 1000, 3),
+            "db_queries":  round(entry["db_queries"] / n, 2),
+            "api_calls":   round(entry["api_calls"] / n, 2),
+        }
+    uncovered = [describe(h) for h in all_handlers(handlers) if id(h) not in covered]
+    return {"steps": result, "uncovered": uncovered}
+
+def regressions(steps: dict, baseline: dict, threshold: float, slack_ms: float) -> list[str]:
+    """
+    Шаги, ставшие дороже базовой линии: CPU больше чем в threshold раз
+    (и больше чем на slack_ms), либо больше SQL-запросов.
+    """
+    failed = []
+    for label, base in baseline.items():
+        cur = steps.get(label)
+        if cur is None:
+            continue
+        limit = max(base["cpu_ms"] * threshold, base["cpu_ms"] + slack_ms)
+        if cur["cpu_ms"] > limit:
+            failed.append(f"{label}: cpu {cur['cpu_ms']} ms > {limit:.3f} ms (baseline {base['cpu_ms']})")
+        if cur["db_queries"] > base["db_queries"]:
+            failed.append(f"{label}: db queries {cur['db_queries']} > baseline {base['db_queries']}")
+    return failed
+
+def main():
+    ap = argparse.ArgumentParser(description="In-process handler CPU / DB-call benchmark")
+    ap.add_argument("--iterations", type=int, default=50)
+    ap.add_argument("--warmup", type=int, default=3)
+    ap.add_argument("--students", type=int, default=500)
+    ap.add_argument("--history-days", type=int, default=30)
+    ap.add_argument("--save", help="записать результат как базовую линию (JSON)")
+    ap.add_argument("--baseline", help="сравнить с базовой линией и упасть при регрессии")
+    ap.add_argument("--threshold", type=float, default=1.5, help="допустимый рост CPU, раз")
+    ap.add_argument("--slack-ms", type=float, default=0.5, help="допустимый рост CPU, мс (шум)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    args = ap.parse_args()
+
+    result = asyncio.run(run(args))
+    steps = result["steps"]
+    if args.json:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    else:
+        print(f"{'step':16} {'cpu ms':>8} {'p99 ms':>8} {'sql':>6} {'api':>5}  handler")
+        for label, s in steps.items():
+            print(f"{label:16} {s['cpu_ms']:>8} {s['wall_p99_ms']:>8} {s['db_queries']:>6} {s['api_calls']:>5}  {s['handler']}")
+        if result["uncovered"]:
+            print("\nNot reached by any step:", ", ".join(result["uncovered"]))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(steps, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            failed = regressions(steps, json.load(f), args.threshold, args.slack_ms)
+        for line in failed:
+            print("REGRESSION", line)
+        if failed:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
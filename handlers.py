@@ -1,7 +1,10 @@
 # handlers.py
 from __future__ import annotations
 
+import asyncio
+import os
 import re
+import tempfile
 from datetime import datetime, timedelta, date
 from typing import Union
 
@@ -23,7 +26,7 @@ from telegram.ext import (
     filters,
 )
 
-import db, utils
+import db, export, timing, utils
 
 # ───────── Conversation States ─────────
 (
@@ -40,6 +43,9 @@ import db, utils
     STUDENT_INFO
 ) = range(11)
 
+# Студентов на одной странице сводки P/A/L
+SUMMARY_PAGE = 50
+
 # ───────── Localization ─────────
 LOCALES = {
     "en": {
@@ -61,7 +67,10 @@ LOCALES = {
         "summary_late":     "⏰ Late",
         "enter_sid":        "Enter student ID for details:",
         "no_events":        "No events found.",
-        "export_csv":       "📥 CSV export not implemented yet.",
+        "export_csv":       "📥 Choose export period:",
+        "export_wait":      "⏳ Preparing export…",
+        "export_failed":    "⚠️ Export failed, please try again later.",
+        "admin_only":       "⛔ Admins only: log in with /admin first.",
         "back":             "🔙 Back",
     },
     "ru": {
@@ -83,7 +92,10 @@ LOCALES = {
         "summary_late":     "⏰ Опоздали",
         "enter_sid":        "Введите ID студента для детализации:",
         "no_events":        "События не найдены.",
-        "export_csv":       "📥 Экспорт CSV ещё не реализован.",
+        "export_csv":       "📥 Выберите период выгрузки:",
+        "export_wait":      "⏳ Готовим выгрузку…",
+        "export_failed":    "⚠️ Не удалось сделать выгрузку, попробуйте позже.",
+        "admin_only":       "⛔ Только для админа: сначала войдите через /admin.",
         "back":             "🔙 Назад",
     },
     "uz": {
@@ -105,7 +117,10 @@ LOCALES = {
         "summary_late":     "⏰ Kechikdi",
         "enter_sid":        "Talaba ID sini kiriting (detallar uchun):",
         "no_events":        "Voqealar topilmadi.",
-        "export_csv":       "📥 CSV eksport hali yo‘q.",
+        "export_csv":       "📥 Eksport davrini tanlang:",
+        "export_wait":      "⏳ Eksport tayyorlanmoqda…",
+        "export_failed":    "⚠️ Eksport amalga oshmadi, keyinroq urinib ko‘ring.",
+        "admin_only":       "⛔ Faqat admin uchun: avval /admin orqali kiring.",
         "back":             "🔙 Orqaga",
     }
 }
@@ -190,8 +205,7 @@ async def reg_student(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lang = context.user_data["lang"]
     loc = LOCALES[lang]
 
-    valid = {s["student_id"] for s in utils.load_students()}
-    if sid not in valid:
+    if utils.get_student(sid) is None:
         await update.message.reply_text(loc["invalid_student"])
         return REG_STUDENT
 
@@ -300,15 +314,16 @@ async def attendance_command(update_or_q, context: ContextTypes.DEFAULT_TYPE):
         "Date        |  In  | Out  | Status",
         "------------|------|------|-------",
     ]
+    start = datetime.combine(days[0],  datetime.min.time())
+    end   = datetime.combine(days[-1], datetime.max.time())
+    daily = db.query_student_daily(sid, start, end)
     for day in days:
-        start = datetime.combine(day, datetime.min.time())
-        end   = datetime.combine(day, datetime.max.time())
-        evs = [e for e in db.query_events_between(start, end) if e[0]==sid]
-        if not evs:
+        if day.isoformat() not in daily:
             rows.append(f"{day} |  —   |  —   | ❌")
         else:
-            ins  = min([e[2][11:16] for e in evs if e[1]=="Kirdi"], default="—")
-            outs = max([e[2][11:16] for e in evs if e[1]=="Chiqdi"], default="—")
+            first_in, last_out = daily[day.isoformat()]
+            ins  = first_in[11:16] if first_in else "—"
+            outs = last_out[11:16] if last_out else "—"
             rows.append(f"{day} | {ins:>5}| {outs:>5}| ✅")
 
     text = f"{loc['attendance_title']}\n```text\n" + "\n".join(rows) + "\n```"
@@ -341,6 +356,7 @@ async def notif_menu(update_or_q, context: ContextTypes.DEFAULT_TYPE):
                 callback_data="toggle_late_on"
             ),
         ],
+        [InlineKeyboardButton(f"📬 Digest: {p['digest'] or 'off'}", callback_data="toggle_digest")],
         [InlineKeyboardButton(loc["back"], callback_data="back_parent")],
     ])
 
@@ -353,7 +369,10 @@ async def notif_menu(update_or_q, context: ContextTypes.DEFAULT_TYPE):
 async def notif_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query; await q.answer()
     fld = q.data.split("_",1)[1]
-    db.toggle_notification(q.message.chat.id, fld)
+    if fld == "digest":
+        db.cycle_digest(q.message.chat.id)
+    else:
+        db.toggle_notification(q.message.chat.id, fld)
     return await notif_menu(q, context)
 
 # ======================================================================
@@ -365,6 +384,7 @@ async def admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def admin_login(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if db.register_admin(update.message.chat.id, update.message.text.strip()):
+        context.user_data["is_admin"] = True
         await show_admin_menu(update, context)
     else:
         await update.message.reply_text("❌ Wrong admin code.")
@@ -403,34 +423,209 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ])
         return await q.edit_message_text(loc["logs_title"], reply_markup=kb)
 
-    m = re.fullmatch(r"summary_(\d+)", action)
+    m = re.fullmatch(r"summary_(\d+)(?:_(\d+))?", action)
     if m:
-        days = int(m.group(1))
-        end = datetime.now()
+        days, page = int(m.group(1)), int(m.group(2) or 0)
+        end = date.today()
         start = end - timedelta(days=days-1)
-        evs = db.query_events_between(start, end)
-        all_ids = {s["student_id"] for s in utils.load_students()}
-
-        present = {r[0] for r in evs if r[1] == "Kirdi"}
-        absent = all_ids - present
-        cutoff = end.replace(hour=9, minute=30, second=0, microsecond=0)
-        late = {r[0] for r in evs if r[1]=="Kirdi" and datetime.fromisoformat(r[2]) > cutoff}
+        total = db.count_students()
+        pages = max(1, -(-total // SUMMARY_PAGE))
+        page = min(page, pages - 1)
+        ids = db.student_ids_page(page*SUMMARY_PAGE, SUMMARY_PAGE)
+
+        stats = db.summary_by_student(ids, start, end)
+        present = [f"{sid} ({stats[sid][0]})" for sid in ids if sid in stats and stats[sid][0]]
+        absent  = [sid for sid in ids if not (sid in stats and stats[sid][0])]
+        late    = [f"{sid} ({stats[sid][1]})" for sid in ids if sid in stats and stats[sid][1]]
+        per_day = [
+            f"{day}: ✅ {p}  ❌ {total - p}  ⏰ {l}"
+            for day, p, l in db.summary_by_day(start, end)
+        ]
 
         text = (
-            f"{loc['summary_present']}: {', '.join(sorted(present)) or '—'}\n\n"
-            f"{loc['summary_absent']}:  {', '.join(sorted(absent)) or '—'}\n\n"
-            f"{loc['summary_late']}:    {', '.join(sorted(late)) or '—'}"
+            ("\n".join(per_day) + "\n\n" if per_day else "") +
+            f"{loc['summary_present']}: {', '.join(present) or '—'}\n\n"
+            f"{loc['summary_absent']}:  {', '.join(absent) or '—'}\n\n"
+            f"{loc['summary_late']}:    {', '.join(late) or '—'}\n\n"
+            f"{page + 1}/{pages}"
+        )
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("◀️", callback_data=f"summary_{days}_{page-1}"))
+        if page < pages - 1:
+            nav.append(InlineKeyboardButton("▶️", callback_data=f"summary_{days}_{page+1}"))
+        kb = InlineKeyboardMarkup(
+            ([nav] if nav else []) +
+            [[InlineKeyboardButton(loc["back"], callback_data="back_admin")]]
         )
-        back_kb = InlineKeyboardMarkup([[InlineKeyboardButton(loc["back"], callback_data="back_admin")]])
-        return await q.edit_message_text(text, reply_markup=back_kb)
+        return await q.edit_message_text(text, reply_markup=kb)
 
     if action == "student_info":
         await q.edit_message_text(loc["enter_sid"])
         return STUDENT_INFO
 
     if action == "export":
-        back_kb = InlineKeyboardMarkup([[InlineKeyboardButton(loc["back"], callback_data="back_admin")]])
-        return await q.edit_message_text(loc["export_csv"], reply_markup=back_kb)
+        kb = InlineKeyboardMarkup([
+            [InlineKeyboardButton("7d: CSV",      callback_data="export_7"),
+             InlineKeyboardButton("30d: CSV",     callback_data="export_30")],
+            [InlineKeyboardButton("All: CSV.gz",  callback_data="export_0")],
+            [InlineKeyboardButton(loc["back"], callback_data="back_admin")],
+        ])
+        return await q.edit_message_text(loc["export_csv"], reply_markup=kb)
+
+async def export_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Кнопки export_N (N дней, 0 — всё). Зарегистрирован с block=False:
+    выгрузка не задерживает апдейты остальных пользователей.
+    """
+    q = update.callback_query; await q.answer()
+    chat_id = q.message.chat.id
+    parent = db.get_parent(chat_id)
+    loc = LOCALES[parent["language"] if parent else "en"]
+    if not context.user_data.get("is_admin"):
+        return await q.edit_message_text(loc["admin_only"])
+
+    days = int(q.data.split("_", 1)[1])
+    end = datetime.now()
+    start = end - timedelta(days=days) if days else datetime(1970, 1, 1)
+    await q.edit_message_text(loc["export_wait"])
+    await send_export(context, chat_id, start, end, gz=not days, loc=loc)
+
+async def send_export(context: ContextTypes.DEFAULT_TYPE, chat_id: int,
+                      start: datetime, end: datetime, student_id: str = None, gz: bool = False,
+                      loc: dict = None):
+    """
+    Выгружает события во временный CSV в отдельном потоке и отправляет файлом.
+    При ошибке сообщает админу, а не оставляет «Готовим выгрузку…».
+    """
+    suffix = ".csv.gz" if gz else ".csv"
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        rows = await asyncio.to_thread(export.export_events, path, start, end, student_id, gz)
+        name = f"attendance_{start:%Y%m%d}_{end:%Y%m%d}{'_' + student_id if student_id else ''}{suffix}"
+        with open(path, "rb") as f:
+            await context.bot.send_document(chat_id, document=f, filename=name, caption=f"{rows} rows")
+    except Exception as e:
+        print(f"Ошибка выгрузки: {e}")
+        await context.bot.send_message(chat_id, (loc or LOCALES["en"])["export_failed"])
+    finally:
+        os.remove(path)
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /export [YYYY-MM-DD] [YYYY-MM-DD] [student_id] — выгрузка CSV.gz за период.
+    """
+    chat_id = update.message.chat.id
+    parent = db.get_parent(chat_id)
+    loc = LOCALES[parent["language"] if parent else "en"]
+    if not context.user_data.get("is_admin"):
+        return await update.message.reply_text(loc["admin_only"])
+
+    args = context.args or []
+    try:
+        start = datetime.fromisoformat(args[0]) if len(args) > 0 else datetime(1970, 1, 1)
+        end = (datetime.combine(date.fromisoformat(args[1]), datetime.max.time())
+               if len(args) > 1 else datetime.now())
+    except ValueError:
+        return await update.message.reply_text("/export [YYYY-MM-DD] [YYYY-MM-DD] [student_id]")
+    student_id = args[2] if len(args) > 2 else None
+
+    await update.message.reply_text(loc["export_wait"])
+    await send_export(context, chat_id, start, end, student_id, gz=True, loc=loc)
+
+async def timings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /timings — самые дорогие хэндлеры: вызовы, среднее/макс. время ответа,
+    время блокировки event loop и SQL-запросов на вызов.
+    """
+    parent = db.get_parent(update.message.chat.id)
+    loc = LOCALES[parent["language"] if parent else "en"]
+    if not context.user_data.get("is_admin"):
+        return await update.message.reply_text(loc["admin_only"])
+
+    rows = timing.summary()
+    if not rows:
+        return await update.message.reply_text(loc["no_events"])
+    lines = ["calls   avg   max  block  sql  handler"]
+    for r in rows:
+        lines.append(f"{r['calls']:>5} {r['avg_ms']:>5.0f} {r['max_ms']:>5.0f} "
+                     f"{r['block_ms']:>6.1f} {r['sql']:>4.1f}  {r['handler'][:40]}")
+    cache = db.parent_cache_info()
+    lookups = cache["hits"] + cache["misses"]
+    lines.append(f"\nparent cache: {cache['hits']}/{lookups} hits, size {cache['size']}")
+    await update.message.reply_text("```text\n" + "\n".join(lines) + "\n```", parse_mode="Markdown")
+
+def _dur(ms) -> str:
+    if ms is None:
+        return "—"
+    return f"{ms:.0f}ms" if abs(ms) < 1000 else f"{ms / 1000:.1f}s"
+
+def _delta(a, b) -> str:
+    return _dur(b - a) if a is not None and b is not None else "—"
+
+async def trace_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /trace student_id [YYYY-MM-DD] — где задержалось уведомление: для каждого
+    события устройство -> приём -> БД, для каждого чата очередь -> отправка -> ответ.
+    """
+    parent = db.get_parent(update.message.chat.id)
+    loc = LOCALES[parent["language"] if parent else "en"]
+    if not context.user_data.get("is_admin"):
+        return await update.message.reply_text(loc["admin_only"])
+
+    args = context.args or []
+    try:
+        day = date.fromisoformat(args[1]) if len(args) > 1 else date.today()
+    except ValueError:
+        day = None
+    if not args or day is None:
+        return await update.message.reply_text("/trace student_id [YYYY-MM-DD]")
+    start = datetime.combine(day, datetime.min.time())
+    rows = db.query_traces(args[0], start, start + timedelta(days=1))
+    if not rows:
+        return await update.message.reply_text(loc["no_events"])
+
+    # строки события: сначала приём (chat_id = 0, если он записан), затем доставки
+    lines, current, last = [], None, None
+    for event_id, event_time, device_id, chat_id, fetched, committed, enq, send, acked, attempts in rows:
+        if event_id != current:
+            current, last = event_id, committed
+            device_ms = datetime.fromisoformat(event_time[:19]).timestamp() * 1000
+            lines.append(f"{event_time[11:19]} {device_id or '—'} #{event_id}\n"
+                         f"  fetch {_delta(device_ms, fetched)} · db {_delta(fetched or device_ms, committed)}")
+        if chat_id == 0:
+            continue
+        status = "✅" if acked else "❌"
+        lines.append(f"  → {chat_id}: enqueue {_delta(last, enq)} · wait {_delta(enq, send)} · "
+                     f"telegram {_delta(send, acked)} {status} ×{attempts}")
+    # лимит сообщения Telegram — 4096 символов: заголовок и первые события, обрезка по строке
+    text = f"Trace {args[0]} {day}:"
+    for line in lines:
+        if len(text) + len(line) + 3 > 4000:
+            text += "\n…"
+            break
+        text += "\n" + line
+    await update.message.reply_text(text)
+
+def _history_page(sid: str, loc: dict, before=None, after=None):
+    """
+    Текст и клавиатура страницы истории студента.
+    """
+    rows, has_older, has_newer = db.query_student_history(sid, before=before, after=after)
+    back = [InlineKeyboardButton(loc["back"], callback_data="back_admin")]
+    if not rows:
+        return loc["no_events"], InlineKeyboardMarkup([back])
+
+    lines = [f"{r[2][:10]} {r[2][11:16]} — {'Entry' if r[1] in db.ENTRY_DIRECTIONS else 'Exit'}" for r in rows]
+    # в callback_data только rowid (лимит Telegram — 64 байта), остальное — из БД
+    nav = []
+    if has_newer:
+        nav.append(InlineKeyboardButton("⬅️ Newer", callback_data=f"hist|n|{rows[0][0]}"))
+    if has_older:
+        nav.append(InlineKeyboardButton("Older ➡️", callback_data=f"hist|o|{rows[-1][0]}"))
+    kb = InlineKeyboardMarkup(([nav] if nav else []) + [back])
+    return f"History for {sid}:\n" + "\n".join(lines), kb
 
 async def handle_student_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat.id
@@ -439,17 +634,29 @@ async def handle_student_info(update: Update, context: ContextTypes.DEFAULT_TYPE
     lang = parent.get("language", "en")
     loc = LOCALES[lang]
 
-    rows = [r for r in db.query_events_between(datetime(1970,1,1), datetime.now()) if r[0]==sid]
-    if not rows:
-        text = loc["no_events"]
-    else:
-        lines = [f"{r[2][11:16]} — {'Entry' if r[1]=='Kirdi' else 'Exit'}" for r in rows]
-        text = f"History for {sid}:\n" + "\n".join(lines)
+    text, kb = _history_page(sid, loc)
+    await update.message.reply_text(text, reply_markup=kb)
+    return ConversationHandler.END
 
-    await update.message.reply_text(
-        text,
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(loc["back"], callback_data="back_admin")]])
-    )
+async def student_history_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query; await q.answer()
+    parent = db.get_parent(q.message.chat.id) or {}
+    loc = LOCALES[parent.get("language", "en")]
+    if not context.user_data.get("is_admin"):
+        return await q.edit_message_text(loc["admin_only"])
+
+    _, way, rowid = q.data.split("|")
+    event = db.get_event(int(rowid))
+    if event is None:
+        return await q.edit_message_text(loc["no_events"])
+    sid, event_time = event
+    key = (event_time, int(rowid))
+    text, kb = _history_page(sid, loc, before=key if way == "o" else None, after=key if way == "n" else None)
+    await q.edit_message_text(text, reply_markup=kb)
+
+async def student_info_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """«Назад» во время ввода ID студента: меню админа и выход из разговора."""
+    await admin_callback(update, context)
     return ConversationHandler.END
 
 def get_handlers():
@@ -495,12 +702,19 @@ def get_handlers():
             states={ADMIN_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_login)]},
             fallbacks=[]
         ),
-        CallbackQueryHandler(admin_callback,
-            pattern=r"^(summary|summary_\d+|student_info|export|back_admin)$"
-        ),
+        # выгрузки — неблокирующие (block=False), не держат очередь апдейтов
+        CommandHandler("export", export_command, block=False),
+        CallbackQueryHandler(export_callback, pattern=r"^export_\d+$", block=False),
+        CommandHandler("timings", timings_command),
+        CommandHandler("trace", trace_command),
+        CallbackQueryHandler(student_history_cb, pattern=r"^hist\|"),
+        # student_info — до admin_callback, иначе разговор не начнётся
         ConversationHandler(
-            entry_points=[CallbackQueryHandler(lambda u,c: None, pattern="^student_info$")],
+            entry_points=[CallbackQueryHandler(admin_callback, pattern="^student_info$")],
             states={STUDENT_INFO: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_student_info)]},
-            fallbacks=[CallbackQueryHandler(lambda u,c: show_admin_menu(u,c), pattern="^back_admin$")]
+            fallbacks=[CallbackQueryHandler(student_info_back, pattern="^back_admin$")]
+        ),
+        CallbackQueryHandler(admin_callback,
+            pattern=r"^(summary|summary_\d+(_\d+)?|export|back_admin)$"
         ),
     ]
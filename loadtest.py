@@ -0,0 +1,188 @@
+# loadtest.py
+# Сквозной нагрузочный тест бота без сети: поднимает fake_telegram.py,
+# запускает настоящий Application (getUpdates -> хэндлеры -> SQLite -> ответ)
+# через BOT_API_BASE_URL и гоняет N родителей в замкнутом цикле:
+# каждый следующий шаг родителя — только после ответа бота на предыдущий.
+# Печатает пропускную способность и p50/p99 по хэндлерам и число 429/403.
+#
+# Запуск: python loadtest.py --parents 200 --duration 30 [--p429 0.01] [--json]
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import benchmark
+import bot
+import db
+import fake_telegram
+
+# Действия родителя: (имя, callback_data или текст сообщения)
+ACTIONS = [
+    ("p_att",           "callback"),
+    ("p_notif",         "callback"),
+    ("toggle_entry_on", "callback"),
+    ("p_profile",       "callback"),
+    ("📆 Attendance",   "message"),
+]
+
+def seed_history(ids: list[str], days: int):
+    """
+    Недельная история проходов, чтобы /attendance читал реальные данные.
+    """
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    rows, serial = [], 0
+    for d in range(days):
+        day = today - timedelta(days=d)
+        for sid in ids:
+            serial += 1
+            rows.append((sid, "Kirdi", (day + timedelta(hours=8)).isoformat(timespec="seconds"), "gate-1", serial))
+            serial += 1
+            rows.append((sid, "Chiqdi", (day + timedelta(hours=15)).isoformat(timespec="seconds"), "gate-1", serial))
+    db.add_events_bulk(rows)
+
+def make_update(chat_id: int, n: int, kind: str, data: str) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": f"Parent {chat_id}"}
+    chat = {"id": chat_id, "type": "private"}
+    if kind == "message":
+        return {"message": {"message_id": n, "date": int(time.time()), "chat": chat, "from": user, "text": data}}
+    return {"callback_query": {
+        # id несёт chat_id, чтобы сопоставить answerCallbackQuery с родителем
+        "id":            f"{chat_id}:{n}",
+        "from":          user,
+        "chat_instance": str(chat_id),
+        "data":          data,
+        "message":       {"message_id": 1, "date": int(time.time()), "chat": chat, "text": "menu"},
+    }}
+
+async def parent_loop(fake, waiters: dict, chat_id: int, deadline: float, timeout: float, stats: dict):
+    loop = asyncio.get_running_loop()
+    n = 0
+    while time.perf_counter() < deadline:
+        name, kind = random.choice(ACTIONS)
+        n += 1
+        fut = loop.create_future()
+        waiters[chat_id] = fut
+        t0 = time.perf_counter()
+        fake.push_update(make_update(chat_id, n, kind, name))
+        try:
+            status = await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            status = "timeout"
+        entry = stats.setdefault(name, {"latencies": [], "statuses": {}})
+        entry["latencies"].append(time.perf_counter() - t0)
+        entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+
+async def run(args) -> dict:
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="facepass_load_")
+    db.DB_FILE = os.path.join(workdir, "load.db")
+    db.STUDENTS_FILE = os.path.join(workdir, "none.json")
+    db.init_db()
+    ids, _ = benchmark.seed(args.parents, 0)
+    seed_history(ids, args.history_days)
+    chats = [row["chat_id"] for row in db.load_parents()][:args.parents]
+
+    fake = fake_telegram.FakeTelegram(args.latency / 1000, args.p429, args.p403)
+    server = fake_telegram.serve(fake, args.port)
+    port = server.server_address[1]
+    loop = asyncio.get_running_loop()
+    server_task = loop.run_in_executor(None, server.serve_forever)
+
+    # Ответ бота (или ошибка API) завершает шаг родителя
+    waiters: dict[int, asyncio.Future] = {}
+
+    def resolve(chat_id: int, status):
+        fut = waiters.pop(chat_id, None)
+        if fut and not fut.done():
+            fut.set_result(status)
+
+    def on_call(method, params, status):
+        if method == "answerCallbackQuery":
+            chat_id = int(str(params.get("callback_query_id", "0")).split(":")[0])
+        else:
+            chat_id = int(params.get("chat_id") or 0)
+        if status != 200 or method in fake_telegram.REPLY_METHODS:
+            loop.call_soon_threadsafe(resolve, chat_id, status)
+
+    fake.listeners.append(on_call)
+
+    app = bot.build_app(base_url=f"http://127.0.0.1:{port}/bot", background=False,
+                        concurrent_updates=args.concurrency or False)
+    # Ошибки API (429/403) из хэндлеров — ожидаемы, не засоряем вывод трейсбеками
+    app.add_error_handler(lambda update, context: asyncio.sleep(0))
+    await app.initialize()
+    await app.start()
+    await app.updater.start_polling(poll_interval=0, timeout=1)
+
+    stats: dict[str, dict] = {}
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(
+        parent_loop(fake, waiters, chat_id, deadline, args.timeout, stats) for chat_id in chats
+    ))
+    elapsed = time.perf_counter() - start
+
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    server.shutdown()
+    await server_task
+    server.server_close()
+    db.close()
+
+    handlers = {}
+    for name, entry in sorted(stats.items()):
+        lat = sorted(entry["latencies"])
+        handlers[name] = {
+            "requests":   len(lat),
+            "per_second": round(len(lat) / elapsed, 1),
+            "p50_ms":     round(benchmark.percentile(lat, 50) * 1000, 2),
+            "p99_ms":     round(benchmark.percentile(lat, 99) * 1000, 2),
+            "statuses":   entry["statuses"],
+        }
+    total = sum(h["requests"] for h in handlers.values())
+    return {
+        "parents":        len(chats),
+        "concurrency":    args.concurrency,
+        "seconds":        round(elapsed, 2),
+        "requests":       total,
+        "per_second":     round(total / elapsed, 1) if elapsed else None,
+        "api_calls":      fake.calls,
+        "api_errors":     fake.errors,
+        "handlers":       handlers,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline end-to-end load test against a fake Bot API")
+    ap.add_argument("--parents", type=int, default=200, help="одновременно активных родителей")
+    ap.add_argument("--duration", type=float, default=30, help="длительность, сек")
+    ap.add_argument("--concurrency", type=int, default=0,
+                    help="concurrent_updates Application; 0 — последовательная обработка")
+    ap.add_argument("--history-days", type=int, default=7)
+    ap.add_argument("--latency", type=float, default=0, help="задержка ответа Bot API, мс")
+    ap.add_argument("--p429", type=float, default=0, help="доля ответов 429 RetryAfter")
+    ap.add_argument("--p403", type=float, default=0, help="доля ответов 403 Forbidden")
+    ap.add_argument("--timeout", type=float, default=10, help="ожидание ответа на шаг, сек")
+    ap.add_argument("--port", type=int, default=0, help="порт fake Bot API; 0 — любой свободный")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    args = ap.parse_args()
+
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        return
+    for key, value in result.items():
+        if key != "handlers":
+            print(f"{key:12} {value}")
+    print(f"\n{'handler':16} {'req':>6} {'req/s':>7} {'p50 ms':>8} {'p99 ms':>8}  statuses")
+    for name, h in result["handlers"].items():
+        print(f"{name:16} {h['requests']:>6} {h['per_second']:>7} {h['p50_ms']:>8} {h['p99_ms']:>8}  {h['statuses']}")
+
+if __name__ == "__main__":
+    main()
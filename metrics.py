@@ -0,0 +1,184 @@
+# metrics.py
+# Метрики конвейера в текстовом формате Prometheus: GET /metrics
+# на локальном порту (config.METRICS_PORT). Счётчик/гистограмма — это
+# словарь под локом, поэтому их можно держать включёнными на горячем пути.
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы гистограмм задержек, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Все метрики в порядке объявления
+_registry: list = []
+
+# HTTP-сервер метрик
+_server: ThreadingHTTPServer | None = None
+
+def _escape(value) -> str:
+    # формат Prometheus: в значениях меток экранируются \, " и перевод строки
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """
+    Монотонный счётчик: inc(n, *значения меток).
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labelnames = name, help, labels
+        self._values: dict = {} if labels else {(): 0}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, n: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in items]
+
+class Gauge:
+    """
+    Текущее значение: set(value) либо функция, вызываемая при чтении /metrics.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn=None):
+        self.name, self.help, self.fn = name, help, fn
+        self.value = 0
+        _registry.append(self)
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self):
+        value = self.fn() if self.fn else self.value
+        return [f"{self.name} {value}"]
+
+class Histogram:
+    """
+    Гистограмма: observe(value, *значения меток); корзины BUCKETS.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        self.name, self.help, self.labelnames = name, help, labels
+        self.buckets = buckets
+        self._series: dict = {}  # значения меток -> [счётчики корзин..., +Inf, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        lines = []
+        for labels, series in items:
+            total = 0
+            for le, n in zip((*self.buckets, "+Inf"), series):
+                total += n
+                le_label = 'le="%s"' % le
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le_label)} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {total}")
+        return lines
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines += metric.samples()
+    return "\n".join(lines) + "\n"
+
+# ───────── Метрики конвейера ─────────
+DEVICE_FETCH = Histogram("facepass_device_fetch_seconds",
+                         "AcsEvent page request latency", ("device",))
+DEVICE_ERRORS = Counter("facepass_device_fetch_errors_total",
+                        "Failed AcsEvent requests", ("device",))
+STREAM_IGNORED = Counter("facepass_stream_parts_ignored_total",
+                         "alertStream parts skipped (reason: unsupported content type or bad_payload)",
+                         ("device", "reason"))
+UNKNOWN_STATUS = Counter("facepass_events_unknown_status_total",
+                         "Events skipped: attendanceStatus is neither entry nor exit and the device has no direction",
+                         ("device",))
+EVENTS_INGESTED = Counter("facepass_events_ingested_total",
+                          "New events stored in the database")
+EVENTS_DUPLICATE = Counter("facepass_events_duplicate_total",
+                           "Duplicate events dropped (stage: memory or db)", ("stage",))
+DB_WRITE = Histogram("facepass_db_write_seconds",
+                     "Event batch insert + commit latency")
+SEND = Histogram("facepass_send_seconds",
+                 "Telegram sendMessage latency")
+SENT = Counter("facepass_sent_total",
+               "Notification send attempts by result (ok, retry_after, network, forbidden, error)", ("result",))
+
+def _queue_depth():
+    import dispatcher
+    return dispatcher._dispatcher.queue.qsize() if dispatcher._dispatcher else 0
+
+QUEUE_DEPTH = Gauge("facepass_dispatch_queue_depth",
+                    "Notifications waiting in the dispatcher queue", _queue_depth)
+
+def _parent_cache(key: str):
+    def read():
+        import db
+        return db.parent_cache_info()[key]
+    return read
+
+PARENT_CACHE_HITS = Gauge("facepass_parent_cache_hits",
+                          "Parent profile cache hits since start", _parent_cache("hits"))
+PARENT_CACHE_MISSES = Gauge("facepass_parent_cache_misses",
+                            "Parent profile cache misses since start", _parent_cache("misses"))
+PARENT_CACHE_SIZE = Gauge("facepass_parent_cache_size",
+                          "Parent profiles currently cached", _parent_cache("size"))
+
+# ───────── HTTP ─────────
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def start(port: int, host: str = "127.0.0.1"):
+    """Поднять /metrics в фоновом потоке."""
+    global _server
+    _server = ThreadingHTTPServer((host, port), _Handler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+
+def shutdown():
+    """Остановить HTTP-сервер метрик."""
+    global _server
+    if _server:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
@@ -0,0 +1,154 @@
+# notifications.py
+# Уведомления родителям: фильтр по настройкам, объединение событий
+# одного студента в окне COALESCE_WINDOW и сводки (hourly / daily).
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+import db
+import dispatcher
+import tracing
+import utils
+
+COALESCE_WINDOW   = 60  # секунд; 0 — каждое событие отдельным сообщением
+DIGEST_DAILY_HOUR = 18  # в котором часу отправлять дневную сводку
+
+ENTRY_DIRECTIONS = db.ENTRY_DIRECTIONS
+
+# Открытые окна объединения: (chat_id, student_id) -> {"until", "name", "events", "trace"}
+_pending: dict = {}
+
+# Фоновые задачи (сброс окон и сводки)
+_tasks: list[asyncio.Task] = []
+
+def wants_notification(parent: dict, direction: str, ts_iso: str) -> bool:
+    """
+    Нужно ли уведомлять родителя о событии с учётом его настроек.
+    Опоздание (вход позже db.LATE_CUTOFF) уведомляется при включённом late_on.
+    """
+    if direction in ENTRY_DIRECTIONS:
+        return parent["entry_on"] or (parent["late_on"] and ts_iso[11:19] > db.LATE_CUTOFF)
+    return parent["exit_on"]
+
+def format_message(name: str, events: list[tuple[str, str]], title: str = None) -> str:
+    """
+    events: [(direction, ts_iso), ...]
+    """
+    if len(events) == 1 and not title:
+        direction, ts_iso = events[0]
+        ts = datetime.fromisoformat(ts_iso).strftime("%H:%M:%S")
+        return (
+            f"🎓 {name}\n"
+            f"⏰ {ts}\n"
+            f"➡️ {direction}"
+        )
+    lines = [
+        f"⏰ {datetime.fromisoformat(ts_iso).strftime('%H:%M:%S')} ➡️ {direction}"
+        for direction, ts_iso in events
+    ]
+    return f"🎓 {name}" + (f" — {title}" if title else "") + "\n" + "\n".join(lines)
+
+def _coalesce(chat_id: int, student_id: str, name: str, direction: str, ts_iso: str,
+              trace: tuple = ()):
+    """
+    Первое событие окна уходит сразу, следующие в пределах COALESCE_WINDOW
+    копятся и уходят одним сообщением по истечении окна.
+    trace — id трассируемых событий этого сообщения (см. tracing.py).
+    """
+    if not COALESCE_WINDOW:
+        dispatcher.enqueue(chat_id, format_message(name, [(direction, ts_iso)]), trace=trace)
+        return
+    key = (chat_id, student_id)
+    entry = _pending.get(key)
+    if entry is None:
+        dispatcher.enqueue(chat_id, format_message(name, [(direction, ts_iso)]), trace=trace)
+        _pending[key] = {"until": time.monotonic() + COALESCE_WINDOW, "name": name, "events": [], "trace": []}
+    else:
+        entry["events"].append((direction, ts_iso))
+        entry["trace"] += trace
+
+def flush(force: bool = False):
+    """
+    Отправляет накопленное по истёкшим окнам (все окна, если force).
+    """
+    now = time.monotonic()
+    for key in [k for k, e in _pending.items() if force or e["until"] <= now]:
+        entry = _pending.pop(key)
+        if entry["events"]:
+            dispatcher.enqueue(key[0], format_message(entry["name"], entry["events"]),
+                               trace=tuple(entry["trace"]))
+            if not force:
+                # поток событий продолжается — открываем следующее окно
+                _pending[key] = {"until": now + COALESCE_WINDOW, "name": entry["name"],
+                                 "events": [], "trace": []}
+
+def notify_parents(student_id: str, direction: str, ts_iso: str, event_id: int = None):
+    """
+    Уведомляет о событии всех подписанных родителей (кроме режима сводки).
+    event_id — rowid события, если оно трассируется.
+    """
+    s = utils.get_student(student_id)
+    if not s:
+        return
+    subscribers = db.get_subscribers(student_id)
+    chats = [
+        p["chat_id"] for p in subscribers
+        if not p["digest"] and wants_notification(p, direction, ts_iso)
+    ]
+    # чат, привязанный к студенту кодом регистрации, без профиля родителя
+    legacy = s.get("telegram_chat_id")
+    if legacy and all(p["chat_id"] != legacy for p in subscribers):
+        chats.append(legacy)
+    trace = (event_id,) if tracing.sampled(event_id) else ()
+    for chat_id in chats:
+        _coalesce(chat_id, student_id, s["name"], direction, ts_iso, trace)
+
+def send_digests(mode: str, start: datetime, end: datetime):
+    """
+    Сводка событий за [start, end) родителям с режимом mode.
+    """
+    if start.date() == end.date():
+        title = f"{start:%d.%m %H:%M}–{end:%H:%M}"
+    else:
+        title = f"{start:%d.%m %H:%M}–{end:%d.%m %H:%M}"
+    for p in db.load_parents(digest=mode):
+        if not p["student_id"]:
+            continue
+        s = utils.get_student(p["student_id"])
+        events = [
+            (direction, ts_iso)
+            for direction, ts_iso in db.query_student_events(p["student_id"], start, end)
+            if wants_notification(p, direction, ts_iso)
+        ]
+        if s and events:
+            dispatcher.enqueue(p["chat_id"], format_message(s["name"], events, title))
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(1)
+        flush()
+
+async def _digest_loop():
+    while True:
+        now = datetime.now()
+        next_hour = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        await asyncio.sleep((next_hour - now).total_seconds())
+        try:
+            send_digests("hourly", next_hour - timedelta(hours=1), next_hour)
+            if next_hour.hour == DIGEST_DAILY_HOUR:
+                # скользящие сутки: проходы после DIGEST_DAILY_HOUR попадут в следующую сводку
+                send_digests("daily", next_hour - timedelta(days=1), next_hour)
+        except Exception as e:
+            print(f"Ошибка сводки: {e}")
+
+def start():
+    """Запустить фоновые задачи (из post_init, после dispatcher.start)."""
+    _tasks[:] = [asyncio.create_task(_flush_loop()), asyncio.create_task(_digest_loop())]
+
+async def shutdown():
+    """Остановить задачи и отправить всё накопленное (до dispatcher.shutdown)."""
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    flush(force=True)
@@ -1,140 +1,214 @@
 # polling.py
-# Опрос API турникета и отправка уведомлений родителям
+# Приём событий турникетов (alertStream или опрос) и уведомления родителям
 
+import asyncio
+import httpx
 import time
-import requests
+from collections import OrderedDict
+import api
 import db
-import utils
+import dispatcher
+import metrics
+import notifications
+import tracing
 from telegram import Bot
-from config import BOT_TOKEN
-from datetime import datetime
+from telegram.ext import Application
+from config import DEVICES
+from datetime import datetime, timedelta
 
-# Инициализируем бот и БД
-bot = Bot(token=BOT_TOKEN)
-db.init_db()
+POLL_INTERVAL  = 5
+WINDOW_MINUTES = 5   # окно первого запроса, пока нет последнего события
+STREAM_RETRY   = 60  # секунд polling-режима до повторной попытки alertStream
+RECENT_WINDOW  = 10000  # сколько последних (device_id, serial_no) помнить в памяти
+
+
+# Задача polling внутри event loop приложения
+_task: asyncio.Task | None = None
+
+# Недавние события: дубликаты отсекаются до БД и диспетчера
+_recent: OrderedDict = OrderedDict()
+
+def _cursors(events: list[dict]) -> list[tuple]:
+    """
+    Последнее (по времени и serialNo) событие каждого устройства в пачке.
+    Время курсора — как его отдало устройство, со смещением его часового пояса.
+    """
+    last = {}
+    for ev in events:
+        if not ev.get("device_id"):
+            continue
+        key = (ev["timestamp"], ev.get("serial_no") or 0, ev.get("device_time") or ev["timestamp"])
+        if ev["device_id"] not in last or key[:2] > last[ev["device_id"]][:2]:
+            last[ev["device_id"]] = key
+    return [(device_id, device_time, serial) for device_id, (_, serial, device_time) in last.items()]
+
+def _event_key(ev: dict):
+    if ev.get("device_id") is None or ev.get("serial_no") is None:
+        return None
+    return (ev["device_id"], ev["serial_no"])
+
+def _remember(keys):
+    for key in keys:
+        _recent[key] = None
+    while len(_recent) > RECENT_WINDOW:
+        _recent.popitem(last=False)
+
+def handle_events(events: list[dict]):
+    """
+    Сохраняет пачку событий одной транзакцией (вместе с курсорами устройств)
+    и уведомляет родителей только о новых событиях.
+    events: [{"student_id","direction","timestamp","device_id","serial_no"}, …]
+    """
+    fresh, keys = [], set()
+    for ev in events:
+        ev["timestamp"] = ev.get("timestamp") or datetime.now().isoformat()
+        key = _event_key(ev)
+        if key is not None:
+            if key in _recent or key in keys:
+                continue
+            keys.add(key)
+        fresh.append(ev)
+    if len(fresh) < len(events):
+        metrics.EVENTS_DUPLICATE.inc(len(events) - len(fresh), "memory")
+    if not fresh:
+        return
+    batch = [
+        (ev["student_id"], ev["direction"], ev["timestamp"], ev.get("device_id"), ev.get("serial_no"))
+        for ev in fresh
+    ]
+    t0 = time.perf_counter()
+    added = db.add_events_bulk(batch, _cursors(fresh))
+    metrics.DB_WRITE.observe(time.perf_counter() - t0)
+    if tracing.TRACE_EVERY:
+        committed_at = time.time()
+        fetched = {
+            (ev["student_id"], ev["timestamp"], ev.get("device_id"), ev.get("serial_no")): ev.get("fetched_at")
+            for ev in fresh
+        }
+        for row in added:
+            if tracing.sampled(row[5]):
+                tracing.committed(row[5], fetched.get((row[0], *row[2:5])), committed_at)
+    metrics.EVENTS_INGESTED.inc(len(added))
+    if len(added) < len(fresh):
+        metrics.EVENTS_DUPLICATE.inc(len(fresh) - len(added), "db")
+    _remember(keys)
+    for student_id, direction, ts_iso, _, _, event_id in added:
+        notifications.notify_parents(student_id, direction, ts_iso, event_id)
 
 def handle_event(student_id: str, direction: str, timestamp: str = None):
     """
     Сохраняет событие в БД и отправляет сообщение родителю.
     """
-    # 1) Сохраняем событие
-    db.add_event(student_id, direction)
-
-    # 2) Готовим и отправляем сообщение
-    ts = timestamp or datetime.now().strftime("%H:%M:%S")
-    students = utils.load_students()
-    for s in students:
-        if s["student_id"] == student_id and s.get("telegram_chat_id"):
-            msg = (
-                f"🎓 {s['name']}\n"
-                f"⏰ {ts}\n"
-                f"➡️ {direction}"
-            )
-            bot.send_message(chat_id=s["telegram_chat_id"], text=msg)
-            print(f"Уведомление отправлено: {s['name']} — {direction} в {ts}")
-            break
-
-def run_polling():
-    """
-    Основной цикл: опрашивает API каждые 5 секунд,
-    получает новые события и обрабатывает их.
-    """
-    API_URL = "https://api.univer.example/events" 
-    last_ts = None
-    print("Запуск polling. Ожидание событий...")
+    handle_events([{"student_id": student_id, "direction": direction, "timestamp": timestamp}])
 
+async def poll_device(client: httpx.AsyncClient, device: dict):
+    """
+    Забирает события устройства, новее сохранённого курсора,
+    и обрабатывает каждую страницу сразу.
+    """
+    now = datetime.now().astimezone()
+    cursor = db.get_cursor(device["id"])
+    if cursor:
+        # со смещением устройства (прежние курсоры — без него: устройство
+        # прочтёт их в своём поясе); сравнение — по местному времени устройства
+        start = datetime.fromisoformat(cursor[0])
+        cursor_time, last_serial = cursor[0][:19], cursor[1] or 0
+    else:
+        start = now - timedelta(minutes=WINDOW_MINUTES)
+        cursor_time, last_serial = "", 0
+    try:
+        async for page in api.iter_access_events(client, device, start, now):
+            # startTime включительный — события той же секунды, что и курсор,
+            # отбрасываем по serialNo (если устройство его отдаёт)
+            page = [ev for ev in page if ev["timestamp"] > cursor_time
+                    or ev.get("serial_no") is None or ev["serial_no"] > last_serial]
+            handle_events(page)
+    except Exception as e:
+        print(f"[{device['id']}] Ошибка polling: {e}")
+
+async def poll_loop(client: httpx.AsyncClient, device: dict):
+    """
+    Polling-режим: опрос устройства каждые POLL_INTERVAL секунд.
+    """
     while True:
-        params = {"since": last_ts} if last_ts else {}
-        try:
-            resp = requests.get(API_URL, params=params, timeout=10)
-            resp.raise_for_status()
-            events = resp.json()  # list of dicts: {"student_id","direction","timestamp"}
-
-            for ev in events:
-                handle_event(ev["student_id"], ev["direction"], ev.get("timestamp"))
-                last_ts = ev.get("timestamp", last_ts)
+        await poll_device(client, device)
+        await asyncio.sleep(POLL_INTERVAL)
 
+async def stream_loop(client: httpx.AsyncClient, device: dict):
+    """
+    Push-режим: держит alertStream открытым и переподключается.
+    Пропущенное, пока потока не было, догоняется опросом уже после
+    подключения — так между опросом и потоком не остаётся дыры.
+    Пока поток недоступен — опрашивает устройство каждые POLL_INTERVAL
+    секунд и пробует подключиться снова через STREAM_RETRY секунд.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            async for page in api.iter_alert_stream(
+                client, device, on_connect=lambda: poll_device(client, device)
+            ):
+                handle_events(page)
+            print(f"[{device['id']}] alertStream закрыт, переподключение")
+            await asyncio.sleep(1)
+            continue
         except Exception as e:
-            print(f"Ошибка polling: {e}")
-
-        time.sleep(5)
-
+            print(f"[{device['id']}] alertStream недоступен: {e}")
 
-if __name__ == "__main__":
-    run_polling()
-# polling.py
-# Опрос API турникета и отправка уведомлений родителям
-
-import threading
-import time
-import requests
-import db
-import utils
-from telegram import Bot
-from config import BOT_TOKEN
-from datetime import datetime
+        deadline = loop.time() + STREAM_RETRY
+        while loop.time() < deadline:
+            await poll_device(client, device)
+            await asyncio.sleep(POLL_INTERVAL)
 
-# Флажок для остановки polling
-stop_polling = threading.Event()
-
-# Инициализируем бота и БД
-bot = Bot(token=BOT_TOKEN)
-db.init_db()
-
-def handle_event(student_id: str, direction: str, timestamp: str = None):
+async def run_polling():
     """
-    Сохраняет событие в БД и отправляет сообщение родителю.
+    Основной цикл: для каждого турникета из config.DEVICES — свой цикл
+    приёма событий (alertStream, если "stream" включён, иначе polling).
     """
-    ts_iso = timestamp or datetime.now().isoformat()
-    db.add_event(student_id, direction, ts_iso)
-
-    ts = datetime.fromisoformat(ts_iso).strftime("%H:%M:%S")
-    students = utils.load_students()
-    for s in students:
-        if s["student_id"] == student_id and s.get("telegram_chat_id"):
-            msg = (
-                f"🎓 {s['name']}\n"
-                f"⏰ {ts}\n"
-                f"➡️ {direction}"
-            )
-            bot.send_message(chat_id=s["telegram_chat_id"], text=msg)
-            print(f"Уведомление отправлено: {s['name']} — {direction} в {ts}")
-            break
-
-def run_polling():
-    """
-    Основной цикл: опрашивает API каждые 5 секунд,
-    получает новые события и обрабатывает их.
-    """
-    API_URL = "https://api.univer.example/events"
-    last_ts = None
     print("Запуск polling. Ожидание событий...")
 
-    while not stop_polling.is_set():
-        params = {"since": last_ts} if last_ts else {}
-        try:
-            resp = requests.get(API_URL, params=params, timeout=10)
-            resp.raise_for_status()
-            events = resp.json()  # [{"student_id","direction","timestamp"}, …]
+    async with httpx.AsyncClient(verify=False) as client:
+        await asyncio.gather(*(
+            (stream_loop if d.get("stream") else poll_loop)(client, d)
+            for d in DEVICES
+        ))
 
-            for ev in events:
-                handle_event(ev["student_id"], ev["direction"], ev.get("timestamp"))
-                last_ts = ev.get("timestamp", last_ts)
-
-        except Exception as e:
-            print(f"Ошибка polling: {e}")
-
-        # Пауза с проверкой флажка каждую секунду
-        for _ in range(5):
-            if stop_polling.is_set():
-                break
-            time.sleep(1)
-
-    print("Polling loop stopped")
+def start(app: Application):
+    """
+    Запустить polling как задачу в event loop приложения (из post_init).
+    Диспетчер уведомлений должен быть уже запущен.
+    """
+    global _task
+    _task = asyncio.create_task(run_polling())
 
 def stop():
     """Остановить polling."""
-    stop_polling.set()
+    if _task and not _task.done():
+        _task.cancel()
+
+async def shutdown():
+    """Остановить polling и дождаться завершения задачи."""
+    stop()
+    if _task:
+        await asyncio.gather(_task, return_exceptions=True)
+    print("Polling loop stopped")
+
+async def _main():
+    from config import BOT_TOKEN, METRICS_PORT
+    db.init_db()
+    if METRICS_PORT:
+        metrics.start(METRICS_PORT)
+    async with Bot(token=BOT_TOKEN) as bot:
+        dispatcher.start(bot)
+        notifications.start()
+        tracing.start()
+        try:
+            await run_polling()
+        finally:
+            await notifications.shutdown()
+            await dispatcher.shutdown()
+            await tracing.shutdown()
+            metrics.shutdown()
 
 if __name__ == "__main__":
-    run_polling()
+    asyncio.run(_main())
@@ -0,0 +1,138 @@
+# timing.py
+# Замеры хэндлеров Telegram: каждый callback из get_handlers() (включая
+# состояния разговоров) оборачивается и считает время ответа, время, на
+# которое он занял event loop (синхронные участки между await), и число
+# SQL-запросов. Медленные вызовы печатаются, сводка — командой /timings.
+
+import inspect
+import time
+
+from telegram.ext import ConversationHandler
+
+import db
+import metrics
+
+SLOW_HANDLER_MS = 250  # печатать вызовы дольше этого (по времени ответа)
+
+# имя хэндлера -> [вызовов, сумма wall, max wall, сумма blocking, max blocking, сумма SQL]
+_stats: dict[str, list] = {}
+
+HANDLER_SECONDS = metrics.Histogram("facepass_handler_seconds",
+                                    "Telegram handler wall time", ("handler",))
+
+def all_handlers(handlers: list) -> list:
+    """
+    Плоский список хэндлеров, включая точки входа, состояния и fallbacks разговоров.
+    """
+    flat = []
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            flat += handler.entry_points
+            for state_handlers in handler.states.values():
+                flat += state_handlers
+            flat += handler.fallbacks
+        else:
+            flat.append(handler)
+    return flat
+
+def describe(handler) -> str:
+    """Имя callback и его паттерн/команда: notif_toggle(^toggle_)."""
+    pattern = getattr(handler, "pattern", None)
+    commands = getattr(handler, "commands", None)
+    extra = pattern.pattern if pattern is not None else ("/" + ",".join(sorted(commands)) if commands else "")
+    return f"{handler.callback.__name__}({extra})" if extra else handler.callback.__name__
+
+class _Blocking:
+    """
+    Awaitable-обёртка корутины: шаги coro.send() — это время, когда
+    корутина держит event loop; всё, что она ждёт, отдаётся наружу как есть.
+    """
+    def __init__(self, coro):
+        self.coro = coro
+        self.seconds = 0.0
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            t0 = time.perf_counter()
+            try:
+                if error is not None:
+                    awaited = self.coro.throw(error)
+                else:
+                    awaited = self.coro.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.seconds += time.perf_counter() - t0
+            try:
+                value, error = (yield awaited), None
+            except BaseException as e:  # отмена задачи и т.п. — передаём в корутину
+                value, error = None, e
+
+def _record(name: str, label: str, wall: float, blocking: float, queries: int):
+    entry = _stats.get(name)
+    if entry is None:
+        entry = _stats[name] = [0, 0.0, 0.0, 0.0, 0.0, 0]
+    entry[0] += 1
+    entry[1] += wall
+    entry[2] = max(entry[2], wall)
+    entry[3] += blocking
+    entry[4] = max(entry[4], blocking)
+    entry[5] += queries
+    HANDLER_SECONDS.observe(wall, label)
+    if wall * 1000 > SLOW_HANDLER_MS:
+        print(f"Slow handler {name}: {wall * 1000:.0f} ms "
+              f"(loop blocked {blocking * 1000:.0f} ms, {queries} SQL)")
+
+def _wrap(name: str, callback):
+    # в метрике — только имя callback, без регулярных выражений паттерна
+    label = getattr(callback, "__name__", "handler")
+
+    async def timed(update, context):
+        with db.count_queries() as queries:
+            t0 = time.perf_counter()
+            result = callback(update, context)
+            blocking = time.perf_counter() - t0
+            if inspect.isawaitable(result):
+                step = _Blocking(result)
+                try:
+                    result = await step
+                finally:
+                    blocking += step.seconds
+        _record(name, label, time.perf_counter() - t0, blocking, queries[0])
+        return result
+    timed.__name__ = getattr(callback, "__name__", "timed")
+    timed.__wrapped__ = callback
+    return timed
+
+def instrument(handlers: list) -> list:
+    """
+    Оборачивает callback каждого хэндлера (и хэндлеров внутри разговоров)
+    замером времени. Возвращает тот же список.
+    """
+    for handler in all_handlers(handlers):
+        if not hasattr(handler.callback, "__wrapped__"):
+            handler.callback = _wrap(describe(handler), handler.callback)
+    return handlers
+
+def summary(limit: int = 15) -> list[dict]:
+    """
+    Сводка по хэндлерам, самые дорогие (по суммарному времени) первыми.
+    """
+    rows = []
+    for name, (n, wall, wall_max, block, block_max, queries) in _stats.items():
+        rows.append({
+            "handler":     name,
+            "calls":       n,
+            "avg_ms":      wall / n * 1000,
+            "max_ms":      wall_max * 1000,
+            "block_ms":    block / n * 1000,
+            "block_max_ms": block_max * 1000,
+            "sql":         queries / n,
+            "total":       wall,
+        })
+    rows.sort(key=lambda r: r["total"], reverse=True)
+    return rows[:limit]
+
+def reset():
+    _stats.clear()
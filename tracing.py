@@ -0,0 +1,110 @@
+# tracing.py
+# Трассировка события от турникета до Telegram: время события на устройстве
+# (events.event_time), получения с устройства, записи в БД, постановки в
+# очередь диспетчера, начала отправки и ответа Telegram. Трассы копятся
+# в памяти и пишутся в event_trace пачками; смотреть — /trace у админа.
+
+import asyncio
+import time
+
+import db
+
+TRACE_EVERY = 1    # трассировать каждое N-е событие (по rowid); 0 — выключено
+FLUSH_INTERVAL = 5  # секунд между записями в БД
+FLUSH_BATCH = 500   # или сразу, когда накопилось столько строк
+TRACE_KEEP_DAYS = 7  # хранить трассы столько дней (чистка раз в сутки)
+
+# Доставки в пути: (event_id, chat_id) -> [enqueued, send_start, attempts]
+_open: dict = {}
+
+# Готовые строки event_trace
+_rows: list[tuple] = []
+
+# Когда последний раз чистили старые трассы (time.time())
+_pruned_at = 0.0
+
+# Фоновая запись
+_task: asyncio.Task | None = None
+
+def _ms(t: float = None) -> int:
+    return int((t if t is not None else time.time()) * 1000)
+
+def sampled(event_id) -> bool:
+    return bool(TRACE_EVERY) and event_id is not None and event_id % TRACE_EVERY == 0
+
+def _add(row: tuple):
+    _rows.append(row)
+    if len(_rows) >= FLUSH_BATCH:
+        flush()
+
+def committed(event_id: int, fetched: float | None, at: float):
+    """Событие получено с устройства (fetched) и записано в БД (at)."""
+    _add((event_id, 0, _ms(fetched) if fetched else None, _ms(at), None, None, None, 0))
+
+def enqueued(event_ids, chat_id: int):
+    now = _ms()
+    for event_id in event_ids:
+        _open[(event_id, chat_id)] = [now, None, 0]
+
+def send_start(event_ids, chat_id: int):
+    now = _ms()
+    for event_id in event_ids:
+        entry = _open.get((event_id, chat_id))
+        if entry:
+            entry[1] = now
+            entry[2] += 1
+
+def delivered(event_ids, chat_id: int, ok: bool = True):
+    """Ответ Telegram (ok) или окончательный отказ — доставка закрыта."""
+    acked = _ms() if ok else None
+    for event_id in event_ids:
+        entry = _open.pop((event_id, chat_id), None)
+        if entry:
+            _add((event_id, chat_id, None, None, entry[0], entry[1], acked, entry[2]))
+
+def flush():
+    """Записать накопленные трассы."""
+    if not _rows:
+        return
+    rows = _rows[:]
+    _rows.clear()
+    try:
+        db.add_traces(rows)
+    except Exception as e:
+        print(f"Ошибка записи трасс: {e}")
+
+def prune():
+    """Удалить трассы старше TRACE_KEEP_DAYS."""
+    global _pruned_at
+    _pruned_at = time.time()
+    try:
+        deleted = db.prune_traces(_ms(_pruned_at - TRACE_KEEP_DAYS * 86400))
+    except Exception as e:
+        print(f"Ошибка чистки трасс: {e}")
+        return
+    if deleted:
+        print(f"Удалено старых трасс: {deleted}")
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        flush()
+        if time.time() - _pruned_at >= 86400:
+            prune()
+
+def start():
+    """Запустить периодическую запись трасс (из post_init)."""
+    global _task
+    _task = asyncio.create_task(_flush_loop())
+
+async def shutdown():
+    """Остановить запись; недоставленное сохраняется без ответа Telegram."""
+    global _task
+    if _task:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+    for (event_id, chat_id), entry in list(_open.items()):
+        _rows.append((event_id, chat_id, None, None, entry[0], entry[1], None, entry[2]))
+    _open.clear()
+    flush()
@@ -1,20 +1,15 @@
 # utils.py
-import json
+# Список студентов хранится в SQLite (таблица students, см. db.py)
+import db
 
 def load_students():
-    with open("students.json", "r", encoding="utf-8") as f:
-        return json.load(f)
+    return db.load_students()
 
-def save_students(students):
-    with open("students.json", "w", encoding="utf-8") as f:
-        json.dump(students, f, indent=2, ensure_ascii=False)
+def get_student(student_id):
+    return db.get_student(student_id)
+
+def get_student_by_code(code):
+    return db.get_student_by_code(code)
 
 def register_parent(chat_id, code):
-    students = load_students()
-    for student in students:
-        if (student["registration_code"] == code
-            and student.get("telegram_chat_id") is None):
-            student["telegram_chat_id"] = chat_id
-            save_students(students)
-            return student["name"]
-    return None
+    return db.link_student_chat(code, chat_id)